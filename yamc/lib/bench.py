@@ -0,0 +1,440 @@
+# Author Adam Bobowski
+#
+# Benchmark of compile time and emitted code cost
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+
+from timeit import default_timer as timer
+
+from errors import YamcError
+from parser import Parser
+from static_analysis import CodeAnalysis
+from flow_graph import FlowGraph
+from optimizer import Optimizer
+from optimizer import PASSES
+from optimizer import passes
+from machine_code import MachineCode
+from vm import VirtualMachine
+
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'tests')
+
+# fixed input vectors of tests/program*.imp (one run per vector), other
+# programs are run on ? lines of their header and their outputs checked
+# against > lines
+INPUTS = {
+    'program0': [[1345601]],
+    'program1': [[]],
+    'program2': [[12345678901]],
+    'program3': [[1234567890, 1234567890987654321, 987654321]],
+    'program4': [[20], [100]],
+    'program5': [[20]],
+    'program6': [[1]],
+}
+
+PHASES = ('parse', 'check', 'convert', 'optimize', 'gen')
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    programs = test_programs(args.tests) + generated_programs(args.corpus,
+                                                               args.seed)
+    results = {}
+    ok = True
+    for name, source, inputs, expected in programs:
+        results[name] = bench(source, inputs, args.interpreter, args.profile,
+                              args.outline_arith, args.passes)
+        report(name, results[name])
+        ok &= check(name, results[name], expected)
+
+    if args.out:
+        save(results, args.out)
+
+    if args.save_baseline:
+        save(results, args.save_baseline)
+    elif args.baseline:
+        ok &= compare(load(args.baseline), results, args.tolerance)
+    if not ok:
+        exit(1)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='yamc.py bench',
+                                     description='Benchmark Yamc.')
+    parser.add_argument(
+        '--tests',
+        default=TESTS_DIR,
+        help='directory with program*.imp files')
+    parser.add_argument(
+        '--corpus',
+        type=int,
+        default=20,
+        help='number of generated programs')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='seed of the generated corpus')
+    parser.add_argument(
+        '--interpreter',
+        help='run on the reference interpreter instead of the simulator')
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='lay out memory by block executions of a first run')
+    parser.add_argument(
+        '--outline-arith',
+        action='store_true',
+        help='emit multiplication and division once as subroutines')
+    parser.add_argument(
+        '--passes',
+        type=passes,
+        default=PASSES,
+        help='comma separated SSA optimisations out of %s' % ','.join(PASSES))
+    parser.add_argument(
+        '--out',
+        help='write results as JSON into OUT')
+    parser.add_argument(
+        '--baseline',
+        help='compare results against BASELINE')
+    parser.add_argument(
+        '--save-baseline',
+        metavar='BASELINE',
+        help='save results as BASELINE')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.5,
+        help='allowed relative compile time growth')
+    return parser.parse_args(argv)
+
+
+def test_programs(tests_dir):
+    programs = []
+    for path in sorted(glob.glob(os.path.join(tests_dir, 'program*.imp'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, 'r') as f:
+            source = f.read()
+        if name in INPUTS:
+            programs.append((name, source, INPUTS[name], None))
+        else:
+            inputs, expected = header_runs(source)
+            programs.append((name, source, inputs, expected))
+    return programs
+
+
+# inputs and outputs of header lines '? n' and '> n', a ? line after
+# a > line starts next run
+def header_runs(source):
+    header = re.match(r'\s*\[([^\]]*)\]', source)
+    runs = []
+    for kind, value in re.findall(r'^\s*([?>])\s*(\d+)',
+                                  header.group(1) if header else '', re.M):
+        if not runs or kind == '?' and runs[-1][1]:
+            runs.append(([], []))
+        runs[-1][0 if kind == '?' else 1].append(long(value))
+    if not runs:
+        return [[]], None
+    return [r[0] for r in runs], [r[1] for r in runs]
+
+
+def generated_programs(n, seed):
+    programs = []
+    for i in xrange(n):
+        generator = ProgramGenerator(seed * 1000 + i)
+        source, inputs = generator.generate()
+        programs.append(('generated%d' % i, source, [inputs], None))
+    return programs
+
+
+def bench(source, inputs, interpreter=None, profile=False,
+          outline_arith=False, passes=PASSES):
+    times = {}
+
+    def phase(name, f, *args):
+        start = timer()
+        result = f(*args)
+        times[name] = times.get(name, 0) + timer() - start
+        return result
+
+    parser = phase('parse', Parser)
+    ptree = phase('parse', parser.parse, source)
+    analyser = CodeAnalysis()
+    symtab, ast = phase('check', analyser.check, ptree)
+    graph = phase('convert', FlowGraph().convert, ast)
+    graph = phase('optimize', Optimizer(passes).optimize, graph,
+                  symtab)
+    machine_code = MachineCode(outline_arith)
+    code = phase('gen', machine_code.gen, graph, symtab, analyser.sizes)
+
+    if profile:
+        vm = VirtualMachine(code, machine_code.blocks)
+        vm.run(inputs[0], seed=0)
+        counts = vm.block_counts()
+        machine_code = MachineCode(outline_arith)
+        code = phase('gen', machine_code.gen, graph, symtab, analyser.sizes,
+                     counts)
+
+    runs = []
+    for vector in inputs:
+        if interpreter:
+            runs.append(interpret(interpreter, code, vector))
+        else:
+            vm = VirtualMachine(code, machine_code.blocks)
+            vm.run(vector, seed=0)
+            runs.append({
+                'inputs': vector,
+                'outputs': vm.outputs,
+                'cycles': vm.cycles,
+                'executed': vm.executed()
+            })
+
+    return {
+        'size': len(code),
+        'times': times,
+        'runs': runs
+    }
+
+
+def interpret(interpreter, code, vector):
+    fd, path = tempfile.mkstemp(suffix='.mr')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for line in code:
+                f.write(line + '\n')
+
+        process = subprocess.Popen([interpreter, path],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        stdout, _ = process.communicate(''.join('%d\n' % x for x in vector))
+    finally:
+        os.remove(path)
+
+    cycles = re.search(r'\(\D*(\d+)\)\.\s*$', stdout)
+    if process.returncode or not cycles:
+        logging.error('Interpreter failed')
+        logging.error(stdout)
+        raise YamcError()
+
+    return {
+        'inputs': vector,
+        'outputs': [long(x) for x in re.findall(r'^> (\d+)', stdout, re.M)],
+        'cycles': long(cycles.group(1)),
+        'executed': None
+    }
+
+
+def report(name, result):
+    cycles = ' '.join(str(r['cycles']) for r in result['runs'])
+    total = sum(result['times'].values())
+    sys.stdout.write('%-12s %6d lines %8.1f ms  cycles %s\n' %
+                     (name, result['size'], 1000 * total, cycles))
+
+
+# outputs of runs equal to expected ones, if program has them
+def check(name, result, expected):
+    ok = True
+    for run, outputs in zip(result['runs'], expected or ()):
+        if run['outputs'] != outputs:
+            logging.error('%s: outputs %s for input %s, expected %s', name,
+                          run['outputs'], run['inputs'], outputs)
+            ok = False
+    return ok
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare(baseline, results, tolerance):
+    ok = True
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name], results[name]
+
+        for old_run, new_run in zip(old['runs'], new['runs']):
+            if old_run['outputs'] != new_run['outputs']:
+                logging.error('%s: outputs differ for input %s',
+                              name, new_run['inputs'])
+                ok = False
+            if new_run['cycles'] > old_run['cycles']:
+                logging.error('%s: cycles %d -> %d', name,
+                              old_run['cycles'], new_run['cycles'])
+                ok = False
+
+        for p in PHASES:
+            if p not in old['times']:  # baseline of older compiler
+                continue
+            old_time, new_time = old['times'][p], new['times'][p]
+            if new_time > (1 + tolerance) * old_time:
+                logging.warning('%s: %s time %.1f ms -> %.1f ms', name, p,
+                                1000 * old_time, 1000 * new_time)
+
+    old_cycles = sum(r['cycles'] for n in results if n in baseline
+                     for r in baseline[n]['runs'])
+    new_cycles = sum(r['cycles'] for n in results if n in baseline
+                     for r in results[n]['runs'])
+    if old_cycles:
+        sys.stdout.write('total cycles %d -> %d (%+.1f%%)\n' %
+                         (old_cycles, new_cycles,
+                          100.0 * (new_cycles - old_cycles) / old_cycles))
+    return ok
+
+
+class ProgramGenerator(object):
+    ops = ('+', '-', '*', '/', '%')
+    conditions = ('=', '!=', '<', '>', '<=', '>=')
+
+    def __init__(self, seed):
+        self.rand = random.Random(seed)
+        self.scalars = []
+        self.tables = {}  # name: size
+        self.iterators = []
+        self.loops = 0
+
+    def generate(self, statements=25):
+        rand = self.rand
+        self.scalars = ['v' + chr(ord('a') + i)
+                        for i in xrange(rand.randint(3, 8))]
+        self.tables = {'t' + chr(ord('a') + i): rand.randint(16, 64)
+                       for i in xrange(rand.randint(1, 3))}
+
+        inputs = []
+        body = []
+        for v in self.scalars:
+            if rand.random() < 0.5:
+                body.append('GET %s;' % v)
+                inputs.append(rand.randint(0, 1000))
+            else:
+                body.append('%s := %d;' % (v, rand.randint(0, 100)))
+        body.extend(self.commands(statements, 0))
+        body.extend('PUT %s;' % v for v in self.scalars)
+
+        declarations = self.scalars + ['%s(%d)' % t
+                                       for t in sorted(self.tables.items())]
+        declarations += ['w' + chr(ord('a') + i) for i in xrange(self.loops)]
+        source = ['DECLARE', '    ' + ' '.join(declarations), 'IN']
+        source += ['    ' + line for line in body]
+        source += ['END']
+        return '\n'.join(source) + '\n', inputs
+
+    def commands(self, n, depth):
+        cmds = []
+        for _ in xrange(n):
+            cmds.extend(self.command(depth))
+        return cmds
+
+    def command(self, depth):
+        rand = self.rand
+        kind = rand.random()
+
+        if depth < 2 and kind < 0.1:
+            return self.cmd_for(depth)
+        if depth < 2 and kind < 0.2:
+            return self.cmd_while(depth)
+        if depth < 3 and kind < 0.3:
+            return self.cmd_if(depth)
+        if kind < 0.35:
+            return ['PUT %s;' % self.value()]
+        if kind < 0.5:
+            return self.cmd_assign(self.element())
+        return self.cmd_assign(rand.choice(self.scalars))
+
+    def cmd_assign(self, target):
+        rand = self.rand
+        op = rand.choice(self.ops)
+        cmds = ['%s := %s;' % (target, self.expression(op))]
+        if op in ('+', '*'):  # keep values small
+            cmds.append('%s := %s %% %d;' % (target, target,
+                                             rand.randint(2, 65521)))
+        return cmds
+
+    def cmd_if(self, depth):
+        rand = self.rand
+        cmds = ['IF %s THEN' % self.condition()]
+        cmds += self.indent(self.commands(rand.randint(1, 4), depth + 1))
+        if rand.random() < 0.5:
+            cmds += ['ELSE']
+            cmds += self.indent(self.commands(rand.randint(1, 4), depth + 1))
+        return cmds + ['ENDIF']
+
+    def cmd_for(self, depth):
+        rand = self.rand
+        iterator = 'i' + chr(ord('a') + depth)
+        begin, end = rand.randint(0, 12), rand.randint(0, 12)
+        if rand.random() < 0.5:
+            cmds = ['FOR %s FROM %d TO %d DO' % (iterator, begin, end)]
+        else:
+            cmds = ['FOR %s DOWN FROM %d TO %d DO' % (iterator, end, begin)]
+
+        self.iterators.append(iterator)
+        cmds += self.indent(self.commands(rand.randint(1, 5), depth + 1))
+        self.iterators.pop()
+        return cmds + ['ENDFOR']
+
+    def cmd_while(self, depth):
+        rand = self.rand
+        counter = 'w' + chr(ord('a') + self.loops)
+        self.loops += 1
+
+        cmds = ['%s := %d;' % (counter, rand.randint(0, 6)),
+                'WHILE %s > 0 DO' % counter]
+        body = self.commands(rand.randint(1, 5), depth + 1)
+        body.append('%s := %s - 1;' % (counter, counter))
+        return cmds + self.indent(body) + ['ENDWHILE']
+
+    def expression(self, op):
+        rand = self.rand
+        if rand.random() < 0.2:
+            return self.value()
+        l, r = self.value(), self.value()
+        if op in ('/', '%') and rand.random() < 0.5:
+            r = str(rand.choice((1, 2, 3, 4, 7, 8, 10, 16, 100)))
+        if l.isdigit() and r.isdigit():
+            l = rand.choice(self.scalars)
+        return '%s %s %s' % (l, op, r)
+
+    def condition(self):
+        op = self.rand.choice(self.conditions)
+        l, r = self.value(), self.value()
+        if l.isdigit() and r.isdigit():
+            l = self.rand.choice(self.scalars)
+        return '%s %s %s' % (l, op, r)
+
+    def value(self):
+        rand = self.rand
+        kind = rand.random()
+        if kind < 0.2:
+            return str(rand.randint(0, 20))
+        if kind < 0.35 and self.iterators:
+            return rand.choice(self.iterators)
+        if kind < 0.5:
+            return self.element()
+        return rand.choice(self.scalars)
+
+    def element(self):
+        rand = self.rand
+        name = rand.choice(sorted(self.tables))
+        if self.iterators and rand.random() < 0.7:
+            return '%s(%s)' % (name, rand.choice(self.iterators))
+        return '%s(%d)' % (name, rand.randint(0, self.tables[name] - 1))
+
+    def indent(self, cmds):
+        return ['    ' + c for c in cmds]
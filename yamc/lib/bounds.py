@@ -0,0 +1,220 @@
+# Author Adam Bobowski
+#
+# Ranges of variable values
+
+from machine import is_number
+from machine import is_int
+from machine import is_inttab
+from flow_graph import negate_condition
+
+INF = float('inf')
+ZERO = (0, 0)  # memory and registers of variables start zeroed
+
+
+class Bounds(object):
+    def __init__(self, graph):
+        self.graph = graph
+        self.entry = [None for _ in graph]  # ranges entering block, None
+                                            # if it is never entered
+        self.tables = {}  # table: upper bound of its elements
+        self.starts = {}  # FOR iterator or counter: bound of its start
+        self.analyse()
+
+    # ranges only widen, a bound moving too often is given up, branches
+    # narrow ranges of compared variables on each edge, an edge whose
+    # condition cannot hold is never taken
+    def analyse(self):
+        grown = {}
+        self.entry[0] = {}
+        changed = True
+        while changed:
+            changed = False
+            for i in xrange(len(self.graph)):
+                if self.entry[i] is None:
+                    continue
+                envs = self.block(i)
+                for cmd, env in zip(self.graph[i], envs):
+                    changed |= self.record(cmd, env, grown)
+                for s, env in self.edges(i, envs[-1]):
+                    changed |= self.join(s, env, grown)
+
+    def reached(self, i):
+        return self.entry[i] is not None
+
+    # ranges in block before each command and after the last one
+    def block(self, i):
+        env = self.entry[i] or {}
+        envs = [env]
+        for cmd in self.graph[i]:
+            if cmd[0] == 'divmod':
+                _, q, r, b, c = cmd
+                env = dict(env)
+                env[q], env[r] = self.interval(('/', b, c), env), \
+                    self.interval(('%', b, c), env)
+            elif cmd[0] in ('assign', 'get') and is_int(cmd[1]):
+                env = dict(env)
+                env[cmd[1]] = self.definition(cmd, env)
+            envs.append(env)
+        return envs
+
+    def definition(self, cmd, env):
+        if cmd[0] == 'get':
+            return 0, INF
+        return self.interval(cmd[2], env)
+
+    # FOR iterator counts up to its start + counter at most
+    def clamp(self, var, interval):
+        low, high = interval
+        if var[0] == '@':
+            bound = self.starts.get(var, 0) + self.starts.get('#' + var[1:], 0)
+            high = max(min(high, bound), low)
+        return low, high
+
+    # tables and starts of FOR loops, ranges over the whole program
+    def record(self, cmd, env, grown):
+        if cmd[0] not in ('assign', 'get'):
+            return False
+        a = cmd[1]
+        if is_inttab(a):
+            high = self.definition(cmd, env)[1]
+            return widen(self.tables, a[0], high, grown)
+        if a[0] in '@#' and not increment(cmd) and not decrement(cmd):
+            return widen(self.starts, a, self.definition(cmd, env)[1], grown)
+        return False
+
+    # successors with ranges on the edge to them
+    def edges(self, i, env):
+        block = self.graph[i]
+        last = block[-1] if block else ('',)
+        follow = [i + 1] if i + 1 < len(self.graph) else []
+        if last[0] == 'halt':
+            return []
+        if last[0] == 'goto':
+            return [(last[1], env)]
+        if last[0] != 'if':
+            return [(s, env) for s in follow]
+
+        edges = []
+        taken = self.refine(last[1], env)
+        if taken is not None:
+            edges.append((last[2], taken))
+        not_taken = self.refine(negate_condition(last[1]), env)
+        if not_taken is not None:
+            edges.extend((s, not_taken) for s in follow)
+        return edges
+
+    def join(self, s, env, grown):
+        old = self.entry[s]
+        if old is None:
+            self.entry[s] = dict(env)
+            return True
+
+        joined = {}
+        for var in set(old) | set(env):
+            (low, high), (l, h) = old.get(var, ZERO), env.get(var, ZERO)
+            if l < low or h > high:
+                key = (s, var)
+                grown[key] = grown.get(key, 0) + 1
+                if grown[key] >= 3:
+                    l, h = 0 if l < low else l, INF if h > high else h
+            joined[var] = min(low, l), max(high, h)
+        self.entry[s] = joined
+        return joined != old
+
+    # True or False if ranges decide condition, None if they do not
+    def decide(self, cond, env):
+        if self.refine(cond, env) is None:
+            return False
+        if self.refine(negate_condition(cond), env) is None:
+            return True
+        return None
+
+    # ranges where condition holds, None if it cannot
+    def refine(self, cond, env):
+        op, x, y = cond
+        if x == y:
+            return env if op in ('=', '<=', '>=') else None
+        if op in ('>', '>='):
+            op, x, y = {'>': '<', '>=': '<='}[op], y, x
+
+        (xl, xh), (yl, yh) = self.interval(x, env), self.interval(y, env)
+        if op == '=':
+            xl = yl = max(xl, yl)
+            xh = yh = min(xh, yh)
+        elif op == '!=':
+            if xl == xh == yl == yh:
+                return None
+            if yl == yh:
+                xl, xh = xl + (xl == yl), xh - (xh == yl)
+            elif xl == xh:
+                yl, yh = yl + (yl == xl), yh - (yh == xl)
+        elif op == '<':
+            xh, yl = min(xh, yh - 1), max(yl, xl + 1)
+        else:
+            xh, yl = min(xh, yh), max(yl, xl)
+        if xl > xh or yl > yh:
+            return None
+
+        env = dict(env)
+        if is_int(x):
+            env[x] = xl, xh
+        if is_int(y):
+            env[y] = yl, yh
+        return env
+
+    # (lowest, highest) value
+    def interval(self, value, env):
+        if is_number(value):
+            return value, value
+        if is_int(value):
+            return self.clamp(value, env.get(value, ZERO))
+        if is_inttab(value):
+            return 0, self.tables.get(value[0], 0)
+        op, b, c = value
+        return arithmetic(op, self.interval(b, env), self.interval(c, env))
+
+    def value(self, value, env):
+        return self.interval(value, env)[1]
+
+    def lower(self, value, env):
+        return self.interval(value, env)[0]
+
+
+# saturating like the machine, division by 0 gives 0
+def arithmetic(op, b, c):
+    (bl, bh), (cl, ch) = b, c
+    if op == '+':
+        return bl + cl, bh + ch
+    if op == '-':
+        return max(bl - ch, 0), max(bh - cl, 0)
+    if op == '*':
+        return times(bl, cl), times(bh, ch)
+    if ch == 0:
+        return ZERO
+    if op == '/':
+        low = 0 if cl == 0 or ch == INF else bl // ch
+        return low, bh // max(cl, 1) if bh != INF else INF
+    if bh < cl:  # b % c is b
+        return bl, bh
+    return 0, min(bh, ch - 1)
+
+
+def times(b, c):
+    return b * c if b and c else 0
+
+
+# bound of name raised to high, given up when raised too often
+def widen(bounds, name, high, grown):
+    if high <= bounds.get(name, 0):
+        return False
+    grown[name] = grown.get(name, 0) + 1
+    bounds[name] = high if grown[name] < 3 else INF
+    return True
+
+
+def increment(cmd):
+    return cmd[0] == 'assign' and cmd[2] == ('+', cmd[1], long(1))
+
+
+def decrement(cmd):
+    return cmd[0] == 'assign' and cmd[2] == ('-', cmd[1], long(1))
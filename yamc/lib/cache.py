@@ -0,0 +1,172 @@
+# Author Adam Bobowski
+#
+# Files kept between runs
+
+import cPickle
+import hashlib
+import os
+import shutil
+import sys
+
+LIMIT = 256 * 2 ** 20  # bytes of cache directory, least recently used
+                       # files are removed beyond it
+
+
+# yamc directory in the user cache directory, None if it cannot be made
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'yamc')
+    try:
+        os.makedirs(path)
+    except OSError:
+        pass  # made already or not allowed
+    return path if os.path.isdir(path) else None
+
+
+# file written by write(temporary path) appears at path at once, never
+# half written, readers racing with it see the old file or none
+def publish(path, write):
+    temp = '%s.%d' % (path, os.getpid())
+    if os.path.exists(temp):  # left by process killed while writing
+        os.remove(temp)
+    write(temp)
+    try:
+        os.rename(temp, path)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# value stored under kind and key, None if there is none
+def load(kind, key):
+    directory = cache_dir()
+    if directory is None:
+        return None
+    path = os.path.join(directory, '%s-%s.pickle' % (kind, key))
+    try:
+        with open(path, 'rb') as f:
+            value = cPickle.load(f)
+    except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+        return None
+    used(path)
+    return value
+
+
+# value kept for later runs if cache directory can be written
+def store(kind, key, value):
+    directory = cache_dir()
+    if directory is None:
+        return
+
+    def write(temp):
+        with open(temp, 'wb') as f:
+            cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+
+    path = os.path.join(directory, '%s-%s.pickle' % (kind, key))
+    try:
+        publish(path, write)
+    except (IOError, OSError):
+        return
+    added(directory, path)
+
+
+# file stored under kind and key copied to path, False if there is none
+def fetch(kind, key, path):
+    directory = cache_dir()
+    if directory is None:
+        return False
+    kept = os.path.join(directory, '%s-%s' % (kind, key))
+    try:
+        shutil.copyfile(kept, path)
+    except IOError:
+        return False
+    used(kept)
+    return True
+
+
+# copy of file at path kept for later runs if cache directory can be
+# written
+def keep(kind, key, path):
+    directory = cache_dir()
+    if directory is None:
+        return
+    kept = os.path.join(directory, '%s-%s' % (kind, key))
+    try:
+        publish(kept, lambda temp: shutil.copyfile(path, temp))
+    except (IOError, OSError):
+        return
+    added(directory, kept)
+
+
+# modification time is the last use, files used least recently are
+# removed first
+def used(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+# directory is measured on the first file added and again once this
+# process has added LIMIT / 8 bytes or the measure passes LIMIT, other
+# processes adding files meanwhile are caught up with then
+def added(directory, path):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    if SIZE[0] is None or SIZE[1] + size > LIMIT / 8 or \
+            SIZE[0] + size > LIMIT:
+        SIZE[:] = [trim(directory), 0]
+    else:
+        SIZE[0] += size
+        SIZE[1] += size
+
+SIZE = [None, 0]  # bytes of cache directory last measured and added since
+
+
+# least recently used files removed until directory holds 3/4 of LIMIT
+# at most if it holds more than LIMIT, bytes left in it
+def trim(directory):
+    files = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue  # removed by another process
+        files.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    if total <= LIMIT:
+        return total
+    for _, size, path in sorted(files):
+        if total <= LIMIT * 3 / 4:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    return total
+
+
+# key of values computed from parts by this compiler, values stored by
+# compiler of other sources are never read
+def digest(*parts):
+    return hashlib.sha1(repr((version(),) + parts)).hexdigest()
+
+
+def version():
+    if not VERSION:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        sources = hashlib.sha1(repr(sys.version_info[:2]))
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.py'):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    sources.update(name + f.read())
+        VERSION.append(sources.hexdigest())
+    return VERSION[0]
+
+VERSION = []  # hash of compiler sources once computed
@@ -0,0 +1,129 @@
+# Author Adam Bobowski
+#
+# Compilation of many programs by long running processes
+
+import logging
+
+from multiprocessing import Pool
+
+import cache
+
+from errors import YamcError
+from parser import Parser
+from static_analysis import CodeAnalysis
+from flow_graph import FlowGraph
+from optimizer import Optimizer
+from optimizer import PASSES
+from machine_code import MachineCode
+
+
+class Compiler(object):
+    # parser is built once, when first needed, phases keeping state of
+    # the program compiled are made anew for every program
+    def __init__(self, outline_arith=False, passes=None, use_cache=True):
+        self.parser = None
+        self.outline_arith = outline_arith
+        self.passes = PASSES if passes is None else passes
+        self.use_cache = use_cache
+
+    # machine code of source written to out_path, YamcError once errors
+    # are logged, checked program is cached by source and compiler
+    # sources, code file also by options
+    def compile(self, source, out_path):
+        if not self.use_cache:
+            write_code(out_path, self.generate(*self.check(source)))
+            return
+
+        key = cache.digest(source, self.outline_arith, tuple(self.passes))
+        if cache.fetch('code', key, out_path):
+            return
+        check_key = cache.digest(source)
+        checked = cache.load('check', check_key)
+        if checked is None:
+            checked = self.check(source)
+            cache.store('check', check_key, checked)
+        write_code(out_path, self.generate(*checked))
+        cache.keep('code', key, out_path)
+
+    # symtab, ast and table sizes, the whole program is checked at once,
+    # a statement is not correct apart from declarations and statements
+    # before it
+    def check(self, source):
+        if self.parser is None:
+            self.parser = Parser()
+        ptree = self.parser.parse(source)
+        analyser = CodeAnalysis()
+        symtab, ast = analyser.check(ptree)
+        return symtab, ast, analyser.sizes
+
+    def generate(self, symtab, ast, sizes):
+        graph = FlowGraph().convert(ast)
+        graph = Optimizer(self.passes).optimize(graph, symtab)
+        machine_code = MachineCode(self.outline_arith)
+        return machine_code.gen(graph, symtab, sizes)
+
+    # errors of file, out_path is written if there are none
+    def compile_file(self, file_path, out_path):
+        diagnostics = Diagnostics()
+        logging.getLogger().addHandler(diagnostics)
+        try:
+            with open(file_path, 'r') as f:
+                source = f.read()
+            self.compile(source, out_path)
+        except YamcError:
+            pass
+        except IOError as e:
+            logging.error('%s', e)
+        finally:
+            logging.getLogger().removeHandler(diagnostics)
+        return diagnostics.messages
+
+
+# (file_path, errors) for every (file_path, out_path) in order, each as
+# soon as it and files before it are compiled, by jobs processes with a
+# compiler each
+def compile_files(files, jobs=1, outline_arith=False, passes=None,
+                  use_cache=True):
+    if jobs <= 1 or len(files) <= 1:
+        compiler = Compiler(outline_arith, passes, use_cache)
+        for file_path, out_path in files:
+            yield file_path, compiler.compile_file(file_path, out_path)
+        return
+
+    pool = Pool(min(jobs, len(files)), start_worker,
+                (outline_arith, passes, use_cache))
+    try:
+        for result in pool.imap(compile_in_worker, files):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def start_worker(outline_arith, passes, use_cache):
+    global worker
+    worker = Compiler(outline_arith, passes, use_cache)
+
+
+def compile_in_worker(files):
+    file_path, out_path = files
+    return file_path, worker.compile_file(file_path, out_path)
+
+worker = None  # compiler of pool process
+
+
+# messages logged while handler is added, kept instead of printed
+class Diagnostics(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+# lines are written as they are made
+def write_code(out_path, code):
+    with open(out_path, 'w') as f:
+        for line in code:
+            f.write(line + '\n')
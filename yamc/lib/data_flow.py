@@ -0,0 +1,158 @@
+# Author Adam Bobowski
+#
+# Data flow analysis over Control Flow Graph
+
+from machine import is_int
+from machine import is_inttab
+from machine import is_operation
+
+
+class DataFlow(object):
+    def __init__(self, graph):
+        self.graph = graph
+        self.succ = [self.successors(i) for i in xrange(len(graph))]
+        self.pred = [[] for _ in graph]
+        for i, succ in enumerate(self.succ):
+            for s in succ:
+                self.pred[s].append(i)
+
+        self.depth = self.loop_depths()
+        self.live_in, self.live_out = self.liveness()
+
+    def successors(self, i):
+        block = self.graph[i]
+        succ = [i + 1] if i + 1 < len(self.graph) else []
+
+        if block and block[-1][0] == 'goto':
+            return [block[-1][1]]
+        if block and block[-1][0] == 'halt':
+            return []
+        if block and block[-1][0] == 'if' and block[-1][2] not in succ:
+            return succ + [block[-1][2]]
+        return succ
+
+    # every jump backwards closes a loop over blocks [target, i]
+    def loop_depths(self):
+        depth = [0 for _ in self.graph]
+        for i, succ in enumerate(self.succ):
+            for s in succ:
+                if s <= i:
+                    for b in xrange(s, i + 1):
+                        depth[b] += 1
+        return depth
+
+    def liveness(self):
+        n = len(self.graph)
+        gen = [set() for _ in xrange(n)]
+        kill = [set() for _ in xrange(n)]
+        for i, block in enumerate(self.graph):
+            for cmd in reversed(block):
+                d = defs(cmd)
+                gen[i] -= d
+                kill[i] |= d
+                gen[i] |= uses(cmd)
+
+        live_in = [set() for _ in xrange(n)]
+        live_out = [set() for _ in xrange(n)]
+        changed = True
+        while changed:
+            changed = False
+            for i in reversed(xrange(n)):
+                out = set()
+                for s in self.succ[i]:
+                    out |= live_in[s]
+                live = gen[i] | (out - kill[i])
+                if live != live_in[i] or out != live_out[i]:
+                    live_in[i], live_out[i] = live, out
+                    changed = True
+
+        return live_in, live_out
+
+    # variables live after each command of block
+    def live_after(self, i):
+        live = set(self.live_out[i])
+        after = []
+        for cmd in reversed(self.graph[i]):
+            after.append(live)
+            live = (live - defs(cmd)) | uses(cmd)
+        after.reverse()
+        return after
+
+
+# scalar variables read by value
+def variables(value):
+    if is_int(value):
+        return set([value])
+    if is_inttab(value):
+        return variables(value[1])
+    if is_operation(value):
+        return variables(value[1]) | variables(value[2])
+    return set()
+
+
+# scalar variables read by command
+def uses(cmd):
+    if cmd[0] == 'assign':
+        _, a, b = cmd
+        return variables(b) | (variables(a) if is_inttab(a) else set())
+    if cmd[0] == 'get':
+        _, a = cmd
+        return variables(a) if is_inttab(a) else set()
+    if cmd[0] in ('put', 'if'):
+        return variables(cmd[1])
+    if cmd[0] == 'divmod':
+        return variables(cmd[3]) | variables(cmd[4])
+    return set()
+
+
+# values read by command in order, table elements included
+def reads(cmd):
+    found = []
+
+    def visit(value):
+        if is_int(value):
+            found.append(value)
+        elif is_inttab(value):
+            found.append(value)
+            visit(value[1])
+        elif is_operation(value):
+            visit(value[1])
+            visit(value[2])
+
+    if cmd[0] in ('assign', 'get') and is_inttab(cmd[1]):
+        visit(cmd[1][1])
+    if cmd[0] == 'assign':
+        visit(cmd[2])
+    if cmd[0] in ('put', 'if'):
+        visit(cmd[1])
+    if cmd[0] == 'divmod':
+        visit(cmd[3])
+        visit(cmd[4])
+    return found
+
+
+# scalar variables written by command
+def defs(cmd):
+    if cmd[0] in ('assign', 'get') and is_int(cmd[1]):
+        return set([cmd[1]])
+    if cmd[0] == 'divmod':
+        return set(cmd[1:3])
+    return set()
+
+
+# scalar variables used as table indexes by block
+def indexes(block):
+    found = set()
+
+    def visit(value):
+        if is_inttab(value):
+            found.update(variables(value[1]))
+        elif is_operation(value):
+            visit(value[1])
+            visit(value[2])
+
+    for cmd in block:
+        for value in cmd[1:]:
+            if isinstance(value, tuple):
+                visit(value)
+    return found
@@ -0,0 +1,71 @@
+# Author Adam Bobowski
+#
+# Quotient and remainder of the same operands from one division
+
+from machine import is_int
+from machine import is_number
+from machine import is_operation
+from machine import routine_kind
+from data_flow import defs
+
+
+class DivisionPairing(object):
+    def __init__(self):
+        self.temps = {}  # (b, c): (quotient, remainder) variables
+
+    # b / c or b % c following b % c or b / c in block, operands
+    # unchanged, is copied from temporaries written by divmod of the
+    # first one, temporaries do not live across blocks
+    def pair(self, graph):
+        paired = []
+        for block in graph:
+            consumed = set()
+            avail = set()
+            for cmd in block:
+                key = division(cmd)
+                if key in avail:
+                    consumed.add(key)
+                avail = transfer(cmd, avail)
+
+            for key in sorted(consumed - set(self.temps)):
+                n = len(self.temps)
+                self.temps[key] = ('$q%d' % n, '$r%d' % n)
+
+            avail = set()
+            paired.append([])
+            for cmd in block:
+                paired[-1].extend(self.rewrite(cmd, avail, consumed))
+                avail = transfer(cmd, avail)
+        return paired
+
+    def rewrite(self, cmd, avail, consumed):
+        key = division(cmd)
+        if key not in consumed:
+            return [cmd]
+
+        _, a, (op, b, c) = cmd
+        q, r = self.temps[key]
+        copy = ('assign', a, q if op == '/' else r)
+        if key in avail:
+            return [copy]
+        return [('divmod', q, r, b, c), copy]
+
+
+# operands (b, c) of division worth pairing
+def division(cmd):
+    if cmd[0] != 'assign' or not is_operation(cmd[2]):
+        return None
+    op, b, c = cmd[2]
+    if op not in ('/', '%') or not routine_kind(op, b, c):
+        return None
+    if all(is_int(x) or is_number(x) for x in (b, c)):
+        return b, c
+
+
+def transfer(cmd, avail):
+    changed = defs(cmd)
+    avail = set(k for k in avail if not changed & set(k))
+    key = division(cmd)
+    if key and not changed & set(key):
+        avail.add(key)
+    return avail
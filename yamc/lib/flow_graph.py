@@ -110,12 +110,16 @@ class FlowGraph(object):
         self.cfg[index].append(('if', ('=', counter, long(0)), len(self.cfg) - 1))
 
     def cfg_negate_condition(self, cond):
-        negation = {
-            '=': '!=',
-            '!=': '=',
-            '<': '>=',
-            '>': '<=',
-            '<=': '>',
-            '>=': '<'
-        }
-        return (negation[cond[0]],) + cond[1:]
+        return negate_condition(cond)
+
+
+def negate_condition(cond):
+    negation = {
+        '=': '!=',
+        '!=': '=',
+        '<': '>=',
+        '>': '<=',
+        '<=': '>',
+        '>=': '<'
+    }
+    return (negation[cond[0]],) + cond[1:]
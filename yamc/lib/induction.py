@@ -0,0 +1,132 @@
+# Author Adam Bobowski
+#
+# FOR iterators indexing tables kept as element addresses
+
+from machine import is_number
+from machine import is_int
+from machine import is_inttab
+from machine import is_operation
+from data_flow import DataFlow
+from data_flow import defs
+from optimizer import fold
+
+
+class Induction(object):
+    def __init__(self):
+        self.offsets = {}  # variable: table whose address it is added to
+
+    # iterator read only as table index holds address of the element
+    # t(i) instead of i, t(i) is read straight from it, other tables
+    # u(i) by address difference, counter keeps driving the loop
+    def reduce(self, graph):
+        graph = [propagate(block) for block in graph]
+        depth = DataFlow(graph).depth
+
+        accesses = {}  # iterator: {table: weight}
+        varying = set()
+        for i, block in enumerate(graph):
+            for cmd in block:
+                for var in defs(cmd):
+                    if not (is_iterator(var) and
+                            (initial(cmd) or increment(cmd))):
+                        varying.add(var)
+                plain, indexes = occurrences(cmd)
+                varying.update(plain)
+                for table, var in indexes:
+                    weights = accesses.setdefault(var, {})
+                    weights[table] = weights.get(table, 0) + 10 ** depth[i]
+
+        for var, weights in accesses.iteritems():
+            if is_iterator(var) and var not in varying:
+                self.offsets[var] = max(sorted(weights), key=weights.get)
+        return graph
+
+    # iterators start at address of table once memory is laid out
+    def rebase(self, graph, symtab):
+        rebased = []
+        for block in graph:
+            rebased.append([])
+            for cmd in block:
+                if cmd[0] == 'assign' and cmd[1] in self.offsets and \
+                        initial(cmd):
+                    _, a, b = cmd
+                    base = long(symtab[self.offsets[a]])
+                    if is_number(b):
+                        cmd = ('assign', a, b + base)
+                    elif base:
+                        cmd = ('assign', a, ('+', b, base))
+                rebased[-1].append(cmd)
+        return rebased
+
+
+def is_iterator(var):
+    return var[0] == '@'
+
+
+# i := value starting loop
+def initial(cmd):
+    if cmd[0] != 'assign':
+        return False
+    _, a, b = cmd
+    return (is_number(b) or is_int(b)) and b != a
+
+
+# i := i +- number
+def increment(cmd):
+    if cmd[0] != 'assign' or not is_operation(cmd[2]):
+        return False
+    _, a, (op, b, c) = cmd
+    return op in ('+', '-') and b == a and is_number(c)
+
+
+# scalars read other than as table indexes, table elements with
+# variable indexes
+def occurrences(cmd):
+    plain, indexes = set(), []
+
+    def visit(value):
+        if is_int(value):
+            plain.add(value)
+        elif is_inttab(value) and is_int(value[1]):
+            indexes.append(value)
+        elif is_operation(value):
+            visit(value[1])
+            visit(value[2])
+
+    if cmd[0] in ('assign', 'get') and is_inttab(cmd[1]):
+        visit(cmd[1])
+    if cmd[0] == 'assign' and not increment(cmd):
+        visit(cmd[2])
+    if cmd[0] in ('put', 'if'):
+        visit(cmd[1])
+    if cmd[0] == 'divmod':
+        visit(cmd[3])
+        visit(cmd[4])
+    return plain, indexes
+
+
+# iterator copied from value is read as the value while both hold,
+# FOR counters are set up from the start value this way
+def propagate(block):
+    copies = {}
+    propagated = []
+
+    def value(v):
+        if is_int(v):
+            return copies.get(v, v)
+        if is_operation(v):
+            return v[0], value(v[1]), value(v[2])
+        return v
+
+    for cmd in block:
+        if cmd[0] == 'assign' and is_int(cmd[1]) and not increment(cmd):
+            cmd = ('assign', cmd[1], fold(value(cmd[2])))
+        propagated.append(cmd)
+
+        changed = defs(cmd)
+        for var in copies.keys():
+            if var in changed or copies[var] in changed:
+                del copies[var]
+        if initial(cmd) and is_iterator(cmd[1]):
+            copies[cmd[1]] = cmd[2]
+    return propagated
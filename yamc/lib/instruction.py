@@ -0,0 +1,112 @@
+# Author Adam Bobowski
+#
+# Machine instructions and code templates
+
+from vm import OPCODES
+from vm import JUMP
+from vm import JZERO
+from vm import JODD
+
+OPCODE = dict((name, op) for op, name in enumerate(OPCODES))
+JUMPS = {JUMP: 'a', JZERO: 'b', JODD: 'b'}  # jump: operand with target
+
+
+class Instruction(object):
+    __slots__ = ('op', 'a', 'b')
+
+    # operands are registers and line numbers, target of a jump to block
+    # is Block until blocks are placed
+    def __init__(self, op, a=None, b=None):
+        self.op = op
+        self.a = a
+        self.b = b
+
+    def operands(self):
+        if self.a is None:
+            return ()
+        if self.b is None:
+            return (self.a,)
+        return (self.a, self.b)
+
+    def target(self):
+        return getattr(self, JUMPS[self.op])
+
+    def retarget(self, line):
+        setattr(self, JUMPS[self.op], line)
+
+    def __str__(self):
+        return ' '.join([OPCODES[self.op]] +
+                        [str(x) for x in self.operands()])
+
+
+# lines of code, each made when it is read, no list of lines is built
+# next to the instructions, which are all held until written
+class Listing(object):
+    def __init__(self, code):
+        self.code = code
+
+    def __len__(self):
+        return len(self.code)
+
+    def __iter__(self):
+        return (str(ins) for ins in self.code)
+
+
+class Block(object):
+    __slots__ = ('block',)
+
+    def __init__(self, block):
+        self.block = block
+
+
+class Template(object):
+    # lines of code, $LABEL before instruction names its line, $END the
+    # line after the last one, other names are given when emitted
+    def __init__(self, code):
+        self.lines = []  # (opcode, operands), operands are (kind, value)
+        local = {}
+        for words in (line.split() for line in code.splitlines()):
+            if not words:
+                continue
+            if words[0][0] == '$':
+                local[words.pop(0)] = len(self.lines)
+            self.lines.append((OPCODE[words[0]], words[1:]))
+        local['$END'] = len(self.lines)
+
+        for k, (op, words) in enumerate(self.lines):
+            self.lines[k] = (op, tuple(operand(w, local) for w in words))
+
+    # instructions starting at line base
+    def instructions(self, base, labels):
+        code = []
+        for op, operands in self.lines:
+            values = []
+            for kind, value in operands:
+                if kind is LITERAL:
+                    values.append(value)
+                elif kind is LOCAL:
+                    values.append(base + value)
+                elif value == 'blockjump':
+                    values.append(Block(labels[value]))
+                else:
+                    values.append(labels[value])
+            code.append(Instruction(op, *values))
+        return code
+
+
+def operand(word, local):
+    if word in local:
+        return LOCAL, local[word]
+    if word.isdigit():
+        return LITERAL, int(word)
+    return NAME, word
+
+
+# parsed once for every text
+def template(code):
+    if code not in TEMPLATES:
+        TEMPLATES[code] = Template(code)
+    return TEMPLATES[code]
+
+LITERAL, LOCAL, NAME = range(3)
+TEMPLATES = {}
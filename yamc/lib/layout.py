@@ -0,0 +1,142 @@
+# Author Adam Bobowski
+#
+# Control Flow Graph cleanup and block layout
+
+from flow_graph import negate_condition
+
+
+class Layout(object):
+    def __init__(self):
+        self.blocks = {}  # block: [commands, exit]
+
+    # exits are ('jump', target), ('branch', condition, taken, not taken)
+    # or ('halt',), blocks keep source order so loops stay contiguous
+    def arrange(self, graph):
+        self.explicit(graph)
+        changed = True
+        while changed:
+            changed = False
+            self.prune()
+            for i in sorted(self.blocks):
+                if i in self.blocks:
+                    changed |= self.simplify(i)
+        return self.emit()
+
+    # every block ends with its exit, falling through is a jump
+    def explicit(self, graph):
+        for i, block in enumerate(graph):
+            cmds = list(block)
+            follow = i + 1 if i + 1 < len(graph) else None
+            last = cmds.pop() if cmds and cmds[-1][0] in CONTROL else None
+            if last is None:
+                exit = ('jump', follow) if follow is not None else ('halt',)
+            elif last[0] == 'goto':
+                exit = ('jump', last[1])
+            elif last[0] == 'halt':
+                exit = ('halt',)
+            elif follow is None:
+                exit = ('branch', last[1], last[2], None)
+            else:
+                exit = ('branch', last[1], last[2], follow)
+            self.blocks[i] = [cmds, exit]
+
+    def prune(self):
+        seen = set([0])
+        stack = [0]
+        while stack:
+            for s in successors(self.blocks[stack.pop()][1]):
+                if s not in seen:
+                    seen.add(s)
+                    stack.append(s)
+        for i in self.blocks.keys():
+            if i not in seen:
+                del self.blocks[i]
+
+    def predecessors(self, b):
+        return [i for i, (_, exit) in self.blocks.iteritems()
+                if b in successors(exit)]
+
+    def simplify(self, i):
+        cmds, exit = self.blocks[i]
+        threaded = exit[:1] + tuple(self.thread(t) if k else t for k, t in
+                                    zip(BRANCHING[exit[0]], exit[1:]))
+        if threaded[0] == 'branch' and threaded[2] == threaded[3]:
+            threaded = ('jump', threaded[2])
+        if threaded != exit:
+            self.blocks[i][1] = threaded
+            return True
+        if exit[0] != 'jump':
+            return False
+
+        target = exit[1]
+        cmds_t, exit_t = self.blocks[target]
+        # jump to halt halts, jump back to loop test tests at the bottom
+        if (exit_t[0] == 'halt' and not cmds_t) or \
+                (exit_t[0] == 'branch' and not cmds_t and target < i):
+            self.blocks[i][1] = exit_t
+            return True
+        # block entered only from this one continues it
+        if target != i and target != 0 and self.predecessors(target) == [i]:
+            self.blocks[i] = [cmds + cmds_t, exit_t]
+            del self.blocks[target]
+            return True
+        return False
+
+    # first block on the way to target doing anything
+    def thread(self, target):
+        seen = set()
+        while target is not None and target not in seen:
+            cmds, exit = self.blocks[target]
+            if cmds or exit[0] != 'jump':
+                break
+            seen.add(target)
+            target = exit[1]
+        return target
+
+    # branch falls through to the next block when either side of it is,
+    # the other side gets a block of its own jumping to it
+    def emit(self):
+        ids = sorted(self.blocks)
+        order = []
+        for k, i in enumerate(ids):
+            cmds, exit = self.blocks[i]
+            follow = ids[k + 1] if k + 1 < len(ids) else None
+            cmds = list(cmds)
+            order.append((i, cmds))
+            if exit[0] == 'halt':
+                cmds.append(('halt',))
+            elif exit[0] == 'jump':
+                if exit[1] != follow:
+                    cmds.append(('goto', exit[1]))
+            else:
+                _, condition, taken, not_taken = exit
+                if taken == follow and not_taken is not None:
+                    cmds.append(('if', negate_condition(condition),
+                                 not_taken))
+                else:
+                    cmds.append(('if', condition, taken))
+                    if not_taken != follow:
+                        order.append((None, [('goto', not_taken)]))
+
+        position = dict((i, k) for k, (i, _) in enumerate(order)
+                        if i is not None)
+        return [[retarget(cmd, position) for cmd in cmds]
+                for _, cmds in order]
+
+
+def successors(exit):
+    return [t for k, t in zip(BRANCHING[exit[0]], exit[1:])
+            if k and t is not None]
+
+
+def retarget(cmd, position):
+    if cmd[0] in ('if', 'goto'):
+        return cmd[:-1] + (position[cmd[-1]],)
+    return cmd
+
+CONTROL = ('if', 'goto', 'halt')
+BRANCHING = {  # exit fields that are blocks
+    'jump': (True,),
+    'branch': (False, True, True),
+    'halt': ()
+}
@@ -71,6 +71,8 @@ class Lexer(object):
 
     t_ignore = ' \t\r'
 
+    built = None  # PLY lexer of the first instance
+
     def t_newline(self, t):
         r'\n+'
         t.lexer.lineno += len(t.value)
@@ -89,8 +91,13 @@ class Lexer(object):
         logging.error('Unknown symbols "%s"', t.value.split(' ', 1))
         raise YamcError()
 
-    def __init__(self, **kwargs):
-        self.lexer = lex.lex(module=self, **kwargs)
+    # rules are checked and compiled once for every process, other
+    # lexers are copies of the first one
+    def __init__(self):
+        if Lexer.built is None:
+            Lexer.built = lex.lex(module=self)
+        self.lexer = Lexer.built.clone(self)
+        self.lexer.lineno = 1
 
     def tokenize(self, data):
         self.lexer.input(data)
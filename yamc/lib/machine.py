@@ -2,25 +2,72 @@
 #
 # Machine registers
 
+from bisect import bisect_right
+from collections import OrderedDict
+
+from instruction import Block
+from instruction import JUMPS
+from instruction import OPCODE
+from instruction import Template
+from instruction import template
+from register_file import RegisterFile
+
 
 class Machine(object):
     def __init__(self):
         self.symtab = {}  # memory mapping
         self.blocks = {}  # block: line_no mapping
-        self.code = []    # output code
-        self.k = 0        # line_no
-
-        self.regs = []    # machine registers
-        self.regs = [None for _ in xrange(6)]
+        self.code = []    # output code, Instruction objects
+
+        self.regs = RegisterFile(xrange(6))  # block local registers
+        self.colors = {}  # global variable: register
+        self.live = set()      # variables live after current command
+        self.live_out = set()  # variables live after current block
+        self.indexes = set()   # indexes of table elements of current command
+        self.reads = {}        # variable: positions of reads in block
+        self.position = 0      # current command in block
+        self.consts = OrderedDict()  # scratch register: value it holds
+        self.calls = {}   # routine: return line_no of every call
+        self.offsets = {}  # variable: table whose address it is added to
 
     # BASIC OPERATIONS
 
     # a <- number
     def num(self, number, a):
+        if self.consts.get(a) == number:
+            return self.held(a)
+
+        # derive from the nearest number already in scratch register
+        base, cost = None, num_cost(number)
+        for i, value in self.consts.items():
+            if is_number(value) and abs(number - value) + (i != a) < cost:
+                base, cost = i, abs(number - value) + (i != a)
+
+        if base is not None:
+            if base != a:
+                self.cmd('COPY  a   b', a=a, b=base)
+            self.step(a, number - self.consts[base])
+        else:
+            self.build(number, a)
+
+        self.hold(a, number)
+        return a
+
+    # cycles num takes
+    def num_price(self, number, a):
+        if self.consts.get(a) == number:
+            return 0
+        cost = num_cost(number)
+        for i, value in self.consts.items():
+            if is_number(value):
+                cost = min(cost, abs(number - value) + (i != a))
+        return cost
+
+    def build(self, number, a):
         self.cmd('RESET a', a=a)
 
         if number == 0:
-            return a
+            return
 
         number = bin(number)[3:]  # skip 0b1[number]
         self.cmd('INC   a', a=a)
@@ -28,214 +75,472 @@ class Machine(object):
             self.cmd('SHL   a', a=a)
             if b == '1':
                 self.cmd('INC   a', a=a)
+
+    def step(self, a, delta):
+        for _ in xrange(abs(delta)):
+            self.cmd('INC   a' if delta > 0 else 'DEC   a', a=a)
+
+    # register with number, a <- number if there is none
+    # result is read only
+    def const(self, number, a):
+        for i, value in self.consts.items():
+            if value == number and is_number(value):
+                return self.held(i)
+        return self.num(number, a)
+
+    # SCRATCH REGISTERS
+
+    # scratch register with address of variable
+    def address(self, var, exclude=()):
+        if is_int(var):
+            return self.scratch(self.symtab[var], exclude)
+
+        table, offset = var
+        position = self.symtab[table]
+        if is_number(offset):
+            return self.scratch(position + offset, exclude)
+
+        for i, value in self.consts.items():
+            if value == var:
+                return self.held(i)
+
+        # same index, other table
+        for i, value in self.consts.items():
+            if is_inttab(value) and value[1] == offset and i not in exclude:
+                delta = position - self.symtab[value[0]]
+                if abs(delta) < num_cost(position) + 5:
+                    a = self.spare(exclude)
+                    if a != i:
+                        self.cmd('COPY  a   b', a=a, b=i)
+                    self.step(a, delta)
+                    self.hold(a, var)
+                    return a
+
+        i = self.reg_of(offset)
+        if i is None:
+            i = self.spare(exclude)
+            self.load_var(offset, i)
+        if offset in self.offsets:
+            return self.rebased(var, i, exclude)
+        a = self.spare(tuple(exclude) + (i,))
+        self.num(position, a)
+        self.cmd('ADD   a   i', a=a, i=i)
+        self.hold(a, var)
         return a
 
-    # c <- a * b
+    # address of t(offset) from register i with address of u(offset)
+    def rebased(self, var, i, exclude):
+        table, offset = var
+        delta = self.symtab[table] - self.symtab[self.offsets[offset]]
+        if delta == 0:
+            self.hold(i, var)
+            return i
+
+        a = self.spare(tuple(exclude) + (i,))
+        if abs(delta) < num_cost(abs(delta)) + 5:
+            self.cmd('COPY  a   i', a=a, i=i)
+            self.step(a, delta)
+        elif delta > 0:
+            self.num(delta, a)
+            self.cmd('ADD   a   i', a=a, i=i)
+        else:
+            b = self.const(-delta, self.spare(tuple(exclude) + (i, a)))
+            self.cmd('COPY  a   i', a=a, i=i)
+            self.cmd('SUB   a   b', a=a, b=b)
+        self.hold(a, var)
+        return a
+
+    def scratch(self, number, exclude=()):
+        for i, value in self.consts.items():
+            if value == number and is_number(value):
+                return self.held(i)
+        return self.num(number, self.spare(exclude))
+
+    # unused scratch register, least recently used otherwise
+    def spare(self, exclude=()):
+        for i in SCRATCH:
+            if i not in self.consts and i not in exclude:
+                return i
+        for i in self.consts:
+            if i not in exclude:
+                return i
+
+    def hold(self, reg, value):
+        if reg in SCRATCH:
+            self.consts.pop(reg, None)
+            self.consts[reg] = value
+
+    def held(self, reg):
+        self.hold(reg, self.consts[reg])
+        return reg
+
+    # addresses t(var) are no longer valid
+    def forget(self, var):
+        for i, value in self.consts.items():
+            if is_inttab(value) and value[1] == var:
+                del self.consts[i]
+
+    # registers written by instructions lose their value
+    def clobber(self, code):
+        for ins in code:
+            if ins.op in WRITES:
+                self.consts.pop(ins.a, None)
+
+    # c <- a * b, loops over bits of a, over the smaller one when swap
     # consts: none  |   mutables: a, b, c
-    # TODO add checking which is bigger !!
-    def mul(self, a, b, c):
-        mul = '''
-                RESET   c
-        $LOOP   JZERO   a   $END
-                JODD    a   $ADD
-                JUMP    $SHIFT
-        $ADD    ADD     c   b
-        $SHIFT  SHR     a
-                SHL     b
-                JUMP    $LOOP
-        '''
-        self.cmd(mul, a=a, b=b, c=c)
-
-    # TODO % ONLY (4 registers only !!)
-    # a - remainder
-
-    # d <- a / b
+    def mul(self, a, b, c, swap=False):
+        if swap:
+            self.cmd(MUL_SWAP, a=a, b=b, c=c)
+        self.cmd(MUL, a=a, b=b, c=c)
+
+    # a <- b * number
+    # consts: b     |   mutables: a, 8, 9
+    def mul_number(self, a, b, number):
+        if number == 0:
+            self.cmd('RESET a', a=a)
+            return
+
+        _, chain = mul_chain(number)
+        if a == b and any(step[0] in ('ADD', 'SUB') for step in chain):
+            self.cmd('COPY  9   b', b=b)
+            b = 9
+        elif a != b:
+            self.cmd('COPY  a   b', a=a, b=b)
+
+        for step in chain:
+            if step[0] == 'SHL':
+                self.cmd('SHL   a', a=a)
+            elif step[0] == 'TIMES':  # a * (2^shifts +- 1)
+                _, shifts, op = step
+                self.cmd('COPY  8   a', a=a)
+                for _ in xrange(shifts):
+                    self.cmd('SHL   a', a=a)
+                self.cmd(op + ' a 8', a=a)
+            else:
+                self.cmd(step[0] + ' a b', a=a, b=b)
+
+    # a <- b / 2^k
+    def shr(self, a, b, k):
+        if a != b:
+            self.cmd('COPY  a   b', a=a, b=b)
+        for _ in xrange(k):
+            self.cmd('SHR   a', a=a)
+
+    # a <- b % 2^k
+    # consts: b     |   mutables: a, 9
+    def mod_pow2(self, a, b, k):
+        self.cmd('COPY  9   b', b=b)
+        if k == 1:
+            self.cmd(MOD_2, a=a)
+            return
+
+        # b - (b >> k << k)
+        for _ in xrange(k):
+            self.cmd('SHR   9')
+        for _ in xrange(k):
+            self.cmd('SHL   9')
+        if a != b:
+            self.cmd('COPY  a   b', a=a, b=b)
+        self.cmd('SUB   a   9', a=a)
+
+    # d <- a / b, a <- a % b, b is not checked when known nonzero
     # consts: b     |   mutables: a, c, d, e
-    def div(self, a, b, c, d, e):
-        div = '''
-                JZERO   b   $D_ZERO
-
-                COPY    e   b
-        $L1     COPY    d   e
-                SUB     d   a
-                JZERO   d   $SHL_E
-                JUMP    $DIV
-        $SHL_E  SHL     e
-                JUMP    $L1
-
-        $DIV    RESET   d
-
-        $L2     COPY    c   e
-                SUB     c   a
-                JZERO   c   $ONE
-                SHL     d
-                SHR     e
-                JUMP    $CHECK
-        $ONE    SHL     d
-                INC     d
-                SUB     a   e
-                SHR     e
-
-        $CHECK  COPY    c   b
-                SUB     c   e
-                JZERO   c   $L2
-                JUMP    $END
-
-        $D_ZERO RESET   a
-                RESET   d
-        '''
-        self.cmd(div, a=a, b=b, c=c, d=d, e=e)
-
-    # COMMAND PARSING
+    def div(self, a, b, c, d, e, nonzero=False):
+        self.cmd(DIV_NONZERO if nonzero else DIV, a=a, b=b, c=c, d=d, e=e)
+
+    # SUBROUTINES
+
+    # call site number in link register 5, routine returns through
+    # dispatch, scratch registers are lost
+    def call(self, routine):
+        sites = self.calls.setdefault(routine, [])
+        self.num(len(sites), 5)
+        self.cmd('JUMP  blockjump', blockjump=routine)
+        sites.append(len(self.code))
+        self.consts.clear()
+
+    # jump back to the call site, decision tree over bits of its number,
+    # same text for the same number of sites
+    def dispatch(self, routine):
+        sites = self.calls[routine]
+        labels = dict(('site%d' % n, k) for n, k in enumerate(sites))
+        tree = self.dispatch_tree([(n, 'site%d' % n)
+                                   for n in xrange(len(sites))], [])
+        self.cmd('\n'.join(tree), **labels)
+
+    def dispatch_tree(self, sites, labels):
+        if len(sites) == 1:
+            return ['JUMP ' + sites[0][1]]
+
+        odd = '$ODD%d' % len(labels)
+        labels.append(odd)
+        even_sites = [(n >> 1, k) for n, k in sites if n % 2 == 0]
+        odd_sites = [(n >> 1, k) for n, k in sites if n % 2 == 1]
+
+        code = ['JODD 5 ' + odd]
+        if len(even_sites) > 1:
+            code.append('SHR 5')
+        code.extend(self.dispatch_tree(even_sites, labels))
+        odd_code = self.dispatch_tree(odd_sites, labels)
+        if len(odd_sites) > 1:
+            odd_code.insert(0, 'SHR 5')
+        code.append(odd + ' ' + odd_code[0])
+        code.extend(odd_code[1:])
+        return code
 
+    # CODE EMISSION
+
+    # code: Template or its text, labels: names of registers and of
+    # blockjump, the block jumped to
     def cmd(self, code, **labels):
-        code = [c.split() for c in code.splitlines()]
-        code = [c for c in code if c]
-        code = self.resolve_local_labels(code, labels)
+        if not isinstance(code, Template):
+            code = template(code)
+        code = code.instructions(len(self.code), labels)
+        self.clobber(code)
         self.code.extend(code)
-        self.k += len(code)
-
-    def resolve_local_labels(self, code, glob_labels):
-        def is_label(x): return x[0][0] == '$'
-        labels = {l[0]: self.k + i for i, l in enumerate(code) if is_label(l)}
-        labels['$END'] = self.k + len(code)
-        labels.update(glob_labels)
-        code = [c[1:] if is_label(c[0]) else c for c in code]
-
-        def pack_commands(code):
-            if c[-1] == 'blockjump':
-                if c[0] == 'JZERO':
-                    c[1] = str(labels.get(c[1], c[1]))
-                c[-1] = labels.get('blockjump', 'blockjump')
-                return c
-            return ' '.join(str(x) for x in [labels.get(i, i) for i in code])
-        code = [pack_commands(c) for c in code]
-
-        return code
 
+    # jumps to blocks go to their first lines
     def resolve_global_labels(self):
-        for i, c in enumerate(self.code):
-            if isinstance(c, list):
-                c[-1] = self.blocks[c[-1]]
-                self.code[i] = ' '.join(x for x in c)
+        for ins in self.code:
+            if ins.op in JUMPS and isinstance(ins.target(), Block):
+                ins.retarget(self.blocks[ins.target().block])
 
+    # only modified values still needed are written back
     def end_of_block(self, next_block):
-        for i, var in enumerate(self.regs):
-            if var:
-                self.store_reg(i)
+        self.live = self.live_out
+        for i in self.regs.occupied():
+            self.spill(i)
+
+    def spill(self, reg):
+        var = self.regs[reg]
+        if self.regs.dirty[reg] and self.needed(var):
+            self.store_reg(reg)
+        self.regs.dirty[reg] = False
+
+    def needed(self, var):
+        if is_inttab(var) or var in self.live or var in self.indexes:
+            return True
+        # index of table element still waiting for write back
+        return bool(self.regs.indexed_by(var))
 
     def alloregs(self, l_var, *r_vars):
         for var in r_vars:
             assert not isinstance(var, long)
 
+        # t(i) reads i to be loaded or written back, i evicted meanwhile
+        # is stored even if it is dead after the command
+        self.indexes = set(v[1] for v in (l_var,) + r_vars
+                           if is_inttab(v) and is_int(v[1]))
         regs = [0]
         for var in r_vars:
-            if var in self.regs:
-                regs.append(self.regs.index(var))
-            else:
-                if None in self.regs:
-                    a = self.regs.index(None)
-                else:
+            a = self.reg_of(var)
+            if a is None:
+                a = self.regs.free()
+                if a is None:
                     excludes = list(r_vars)
                     excludes.append(l_var)
-                    a = self.find_lru_reg(exclude=excludes)
-                    self.store_reg(a)
-                self.load_var(var, a)
-                self.regs[a] = var
-                regs.append(a)
+                    a = self.find_victim_reg(exclude=excludes)
+                    self.spill(a)
+                self.load_reg(var, a)
+            elif a in self.regs.registers:
+                self.regs.touch(a)
+            regs.append(a)
 
         if l_var:
-            if l_var in self.regs:
-                regs[0] = self.regs.index(l_var)
+            a = self.reg_of(l_var)
+            if a is None:
+                a = self.regs.free()
+                if a is None:
+                    a = self.find_victim_reg(exclude=r_vars)
+                    self.spill(a)
+            if a in self.regs.registers:
+                self.regs.assign(a, l_var, dirty=True)
+            if is_inttab(l_var):
+                self.drop_aliases(a)
             else:
-                if None in self.regs:
-                    a = self.regs.index(None)
-                else:
-                    a = self.find_lru_reg(exclude=r_vars)
-                    self.store_reg(a)
-                self.regs[a] = l_var
-                regs[0] = a
+                self.forget(l_var)
+            regs[0] = a
 
         return tuple(regs) if len(regs) != 1 else regs[0]
 
-    def find_lru_reg(self, exclude):
-        for i, n in enumerate(self.regs):
-            if n not in exclude:
-                return i
+    def reg_of(self, var):
+        if var in self.colors:
+            return self.colors[var]
+        return self.regs.reg(var)
+
+    # Belady: evict value read again furthest in block, prefer ones
+    # without write back
+    def find_victim_reg(self, exclude):
+        def rank(i):
+            var = self.regs[i]
+            clean = not (self.regs.dirty[i] and self.needed(var))
+            return self.next_use(var), clean
+        return self.regs.victim(exclude, rank)
+
+    # commands until var is read again
+    def next_use(self, var):
+        positions = self.reads.get(var, ())
+        k = bisect_right(positions, self.position)
+        if k < len(positions):
+            return positions[k] - self.position
+        return float('inf')
+
+    # t(i) and t(j) may be the same cell
+    def load_reg(self, var, reg):
+        if is_inttab(var):
+            for i in self.regs.elements(var[0]):
+                if i != reg and self.regs.dirty[i] and \
+                        may_alias(var, self.regs[i]):
+                    self.store_reg(i)
+                    self.regs.dirty[i] = False
+        self.load_var(var, reg)
+        self.regs.assign(reg, var)
+
+    # writing t(i) invalidates cached t(j)
+    def drop_aliases(self, reg):
+        var = self.regs[reg]
+        for i in self.regs.elements(var[0]):
+            if i != reg and may_alias(var, self.regs[i]):
+                self.spill(i)
+                self.regs.release(i)
 
     def store_reg(self, reg):
-        variable = self.regs[reg]
-
-        if is_int(variable):
-            position = self.symtab[variable]
-            self.num(position, 8)
-            self.cmd('STORE reg 8', reg=reg)
-            return
-
-        if is_inttab(variable):
-            variable, offset = variable
-            position = self.symtab[variable]
-
-            if is_number(offset):
-                position += offset
-                self.num(position, 9)
-                self.cmd('STORE reg 9', reg=reg)
-                return
-
-            if offset in self.regs:
-                i = self.regs.index(offset)
-                self.num(position, 9)
-                self.cmd('ADD   9   i', i=i)
-                self.cmd('STORE reg 9', reg=reg)
-            else:
-                self.load_var(offset, 8)
-                self.num(position, 9)
-                self.cmd('ADD   9   8')
-                self.cmd('STORE reg 9', reg=reg)
+        a = self.address(self.regs[reg])
+        self.cmd('STORE reg a', reg=reg, a=a)
 
     def load_var(self, variable, reg):
-        if is_int(variable):
-            position = self.symtab[variable]
-            self.num(position, 8)
-            self.cmd('LOAD  reg 8', reg=reg)
-            return
-
-        if is_inttab(variable):
-            variable, offset = variable
-            position = self.symtab[variable]
-
-            if is_number(offset):
-                position += offset
-                self.num(position, 9)
-                self.cmd('LOAD  reg 9', reg=reg)
-                return
-
-            if offset in self.regs:
-                i = self.regs.index(offset)
-                self.num(position, 9)
-                self.cmd('ADD   9   i', i=i)
-                self.cmd('LOAD  reg 9', reg=reg)
-            else:
-                self.load_var(offset, 8)
-                self.num(position, 9)
-                self.cmd('ADD   9   8')
-                self.cmd('LOAD  reg 9', reg=reg)
+        a = self.address(variable, exclude=(reg,) if reg in SCRATCH else ())
+        self.cmd('LOAD  reg a', reg=reg, a=a)
 
+    # t(a) is another cell once a changes, stored before a is written
     def store_iterators(self, a):
-        for i, variable in enumerate(self.regs):
-            if is_inttab(variable):
-                variable, offset = variable
-                if a == offset:
-                    self.store_reg(i)
-
-    def load_iterators(self, a):
-        for i, var in enumerate(self.regs):
-            if is_inttab(var):
-                variable, offset = var
-                if a == offset:
-                    self.load_var(var, i)
+        for i in self.regs.indexed_by(a):
+            self.spill(i)
+            self.regs.release(i)
+
+    # and elements loaded while a was written are dropped after
+    def release_iterators(self, a):
+        for i in self.regs.indexed_by(a):
+            self.regs.release(i)
+
+# routine of operation b op c, if it is not strength reduced
+def routine_kind(op, b, c):
+    if op == '*' and not (is_number(b) or is_number(c)):
+        return 'mul'
+    if op == '/' and not (is_number(c) and (is_power(c) or c == 0)):
+        return 'div'
+    if op == '%' and not (is_number(c) and (is_power(c) or c <= 1)):
+        return 'mod'
+
+
+# cycles taken by num
+def num_cost(number):
+    if number == 0:
+        return 1
+    number = bin(number)[3:]
+    return 2 + len(number) + number.count('1')
+
+# (cycles, steps) multiplying a = b by number with SHL a, ADD a b,
+# SUB a b and a * (2^shifts +- 1) steps, cheapest of all found
+def mul_chain(number):
+    if number not in CHAINS:
+        CHAINS[number] = min(chain_options(number))
+    return CHAINS[number]
+
+
+def chain_options(number):
+    half = number / 2
+    if number % 2 == 0:
+        yield extend_chain(half, 1, ('SHL',))
+    else:
+        yield extend_chain(half, 6, ('SHL',), ('ADD',))
+        yield extend_chain(half + 1, 6, ('SHL',), ('SUB',))
+
+    for shifts in xrange(2, number.bit_length()):
+        for factor, op in ((2 ** shifts + 1, 'ADD'), (2 ** shifts - 1, 'SUB')):
+            if number % factor == 0:
+                yield extend_chain(number / factor, shifts + 6,
+                                   ('TIMES', shifts, op))
+
+
+def extend_chain(number, cycles, *steps):
+    cost, chain = mul_chain(number)
+    return cost + cycles, chain + steps
+
+CHAINS = {1: (0, ())}
+
+SCRATCH = (6, 7, 8, 9)
+WRITES = set(OPCODE[op] for op in ('RESET', 'INC', 'DEC', 'SHL', 'SHR',
+                                     'ADD', 'SUB', 'COPY', 'LOAD', 'READ'))
+
+MUL_SWAP = Template('''
+            COPY    c   a
+            SUB     c   b
+            JZERO   c   $END
+            COPY    c   a
+            COPY    a   b
+            COPY    b   c
+''')
+
+MUL = Template('''
+            RESET   c
+    $LOOP   JZERO   a   $END
+            JODD    a   $ADD
+            JUMP    $SHIFT
+    $ADD    ADD     c   b
+    $SHIFT  SHR     a
+            SHL     b
+            JUMP    $LOOP
+''')
+
+MOD_2 = Template('''
+            RESET   a
+            JODD    9   $ODD
+            JUMP    $END
+    $ODD    INC     a
+''')
+
+DIV_LOOP = '''
+            COPY    e   b
+    $L1     COPY    d   e
+            SUB     d   a
+            JZERO   d   $SHL_E
+            JUMP    $DIV
+    $SHL_E  SHL     e
+            JUMP    $L1
+
+    $DIV    RESET   d
+
+    $L2     COPY    c   e
+            SUB     c   a
+            JZERO   c   $ONE
+            SHL     d
+            SHR     e
+            JUMP    $CHECK
+    $ONE    SHL     d
+            INC     d
+            SUB     a   e
+            SHR     e
+
+    $CHECK  COPY    c   b
+            SUB     c   e
+            JZERO   c   $L2
+'''
+
+DIV_NONZERO = Template(DIV_LOOP)
+
+DIV = Template('''
+            JZERO   b   $D_ZERO
+''' + DIV_LOOP + '''
+            JUMP    $END
+
+    $D_ZERO RESET   a
+            RESET   d
+''')
 
 def is_number(a): return isinstance(a, long)
 def is_int(a): return isinstance(a, str)
 def is_inttab(a): return isinstance(a, tuple) and len(a) == 2
 def is_operation(a): return isinstance(a, tuple) and len(a) == 3
+def is_power(a): return a > 0 and a & (a - 1) == 0
+def may_alias(a, b): return a == b or not (is_number(a[1]) and is_number(b[1]))
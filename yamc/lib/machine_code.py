@@ -7,48 +7,135 @@ from machine import is_number
 from machine import is_int
 from machine import is_inttab
 from machine import is_operation
+from machine import is_power
+from machine import routine_kind
+from machine import num_cost
+from bounds import Bounds
+from bounds import INF
+from data_flow import DataFlow
+from data_flow import reads
+from vm import COSTS
+from vm import OPCODES
+from vm import JUMP
+from division_pairing import DivisionPairing
+from induction import Induction
+from memory_layout import MemoryLayout
+from instruction import JUMPS
+from instruction import LOCAL
+from instruction import Listing
+from instruction import template
+from peephole import Peephole
+from register_allocation import RegisterAllocation
+from register_file import RegisterFile
 
 
 class MachineCode(Machine):
-    def __init__(self):
+    def __init__(self, outline_arith=False):
         Machine.__init__(self)
+        self.outline_arith = outline_arith
+        self.routines = set()  # arithmetic called as subroutine
         self.graph = None
+        self.flow = None
+        self.bounds = None
+        self.bound = {}   # bounds changed in block before current command
+        self.current = 0  # block being generated
         self.memtab = {}  # symbol table
 
-    def gen(self, graph, symtab):
+    # sizes: table sizes, profile: block executions of previous run
+    def gen(self, graph, symtab, sizes, profile=None):
+        graph = self.pair_divisions(graph, symtab)
+        induction = Induction()
+        graph = induction.reduce(graph)
+        self.offsets = induction.offsets
         self.graph = graph
         self.symtab = symtab
-        #print self.symtab
-        self.gen_code(graph)
-
-        return self.code
+        self.flow = DataFlow(graph)
+        self.bounds = Bounds(graph)
+        if self.outline_arith:
+            self.routines = outlined(graph)
+        self.alloc_globals(graph)
+        self.arrange_memory(graph, sizes, profile)
+        self.gen_code(induction.rebase(graph, self.symtab))
+
+        return Listing(self.code)
+
+    # temporaries of paired divisions are placed by arrange_memory
+    def pair_divisions(self, graph, symtab):
+        pairing = DivisionPairing()
+        graph = pairing.pair(graph)
+        k = max(symtab.values()) + 1 if symtab else 0
+        for temps in sorted(pairing.temps.values()):
+            for temp in temps:
+                symtab[temp] = k
+                k += 1
+        return graph
+
+    # registers 5, 4, 3 keep variables live across blocks,
+    # at least three remain for alloregs, 5 links subroutines
+    def alloc_globals(self, graph):
+        registers = [4, 3] if self.routines else [5, 4, 3]
+        allocation = RegisterAllocation(registers)
+        self.colors = allocation.allocate(graph, self.flow)
+        used = set(self.colors.values())
+        if self.routines:
+            used.add(5)
+        self.regs = RegisterFile(i for i in xrange(6) if i not in used)
+
+        # memory starts zeroed, registers do not
+        for var, reg in sorted(self.colors.iteritems()):
+            if var in self.flow.live_in[0]:
+                self.cmd('RESET a', a=reg)
+
+    def arrange_memory(self, graph, sizes, profile):
+        if profile:
+            frequency = [profile.get(i, 0) for i in xrange(len(graph))]
+        else:
+            frequency = [10 ** d for d in self.flow.depth]
+        layout = MemoryLayout(self.colors)
+        self.symtab = layout.arrange(graph, self.symtab, sizes, frequency)
 
     def gen_code(self, graph):
         for i, b in enumerate(graph):
-            self.blocks[i] = str(len(self.code))
-            self.gen_block(b)
-
+            self.current = i
+            self.blocks[i] = len(self.code)
+            if not self.bounds.reached(i):
+                continue  # no edge to it can be taken
+            self.live_out = self.flow.live_out[i]
+            self.gen_block(b, self.flow.live_after(i), self.bounds.block(i))
+
+        # whole program is held, peephole threads jumps and removes lines
+        # anywhere in it, so no block is final before it ends
+        self.gen_routines()
         self.resolve_global_labels()
+        self.code, self.blocks = Peephole().optimize(self.code, self.blocks)
+
+    def gen_block(self, block, live_after, bounds):
+        self.consts.clear()  # block may be entered by jump
+        self.reads = {}
+        for k, i in enumerate(block):
+            for var in reads(i):
+                self.reads.setdefault(var, []).append(k)
 
-    def gen_block(self, block):
         added = False
-        for i in block:
+        for k, i in enumerate(block):
+            self.position = k
+            self.live = live_after[k]
+            self.indexes = set()
+            self.bound = bounds[k]
             if i[0] == 'if':
                 added = True
                 self.end_of_block(None)
             if i[0] == 'goto':
                 added = True
                 self.end_of_block(None)
+            if i[0] == 'halt':
+                added = True  # memory is not observed after HALT
             getattr(self, "gen_" + i[0])(i)
         if not added:
             self.end_of_block(None)
-        self.regs = [None for _ in xrange(6)]
-
-        #print self.regs
-
+        self.regs.clear()
 
     def gen_assign(self, cmd):
-        # TODO check if a is not interator of table stored
         _, a, b = cmd
 
         self.store_iterators(a)
@@ -64,8 +151,7 @@ class MachineCode(Machine):
             if check(b):
                 assign(a, b)
                 break
-
-        self.load_iterators(a)
+        self.release_iterators(a)
 
     def assign_number(self, a, b):
         a = self.alloregs(a)
@@ -100,7 +186,7 @@ class MachineCode(Machine):
                 for c in xrange(c):
                     self.cmd('INC   a', a=a)
             else:
-                c = self.num(c, 9)
+                c = self.const(c, 9)
                 self.cmd('ADD   a   c', a=a, c=c)
             return
 
@@ -116,6 +202,11 @@ class MachineCode(Machine):
             self.cmd('ADD   a   c', a=a, c=c)
 
     def assign_minus(self, a, b, c):
+        # a := b - c saturates to 0
+        if self.upper(b) <= self.lower(c):
+            self.assign_number(a, long(0))
+            return
+
         # a := b - number
         if is_number(c):
             a, b = self.alloregs(a, b)
@@ -125,7 +216,7 @@ class MachineCode(Machine):
                 for c in xrange(c):
                     self.cmd('DEC   a', a=a)
             else:
-                c = self.num(c, 9)
+                c = self.const(c, 9)
                 self.cmd('SUB   a   c', a=a, c=c)
             return
 
@@ -158,24 +249,43 @@ class MachineCode(Machine):
         if is_number(b):
             b, c = c, b
 
-        if is_number(c):  # todo << and *1 multiplication
+        # a := b * number
+        if is_number(c):
             a, b = self.alloregs(a, b)
-            c = self.num(c, 9)
-            self.cmd('COPY  8   b', b=b)
-        else:
-            a, b, c = self.alloregs(a, b, c)
-            self.cmd('COPY  9   c', c=c)
-            self.cmd('COPY  8   b', b=b)
+            self.mul_number(a, b, c)
+            return
 
-        self.mul(8, 9, a)
+        # loop over the factor known to be smaller, check at runtime
+        # unless it takes at most two rounds, a check costs about one
+        bounds = self.bounds.value(b, self.bound), \
+            self.bounds.value(c, self.bound)
+        a, b, c = self.alloregs(a, b, c)
+        if bounds[1] < bounds[0]:
+            b, c = c, b
+        self.cmd('COPY  9   c', c=c)
+        self.cmd('COPY  8   b', b=b)
+        self.arith('mul', a, swap=b != c and min(bounds) >= 4)
 
     def assign_divide(self, a, b, c):
+        # a := b / c is 0 when b < c
+        if self.below(b, c):
+            self.assign_number(a, long(0))
+            return
+
+        nonzero = self.lower(c) > 0
         if is_number(b):
             a, c = self.alloregs(a, c)
             self.num(b, 6)
             self.cmd('COPY  7   c', c=c)
         elif is_number(c):
             a, b = self.alloregs(a, b)
+            if is_power(c):
+                # a := b / 2^k
+                self.shr(a, b, c.bit_length() - 1)
+                return
+            if c == 0:
+                self.cmd('RESET a', a=a)
+                return
             self.num(c, 7)
             self.cmd('COPY  6   b', b=b)
         else:
@@ -183,234 +293,365 @@ class MachineCode(Machine):
             self.cmd('COPY  6   b', b=b)
             self.cmd('COPY  7   c', c=c)
 
-        self.div(6, 7, 8, a, 9)
+        self.arith('div', a, nonzero=nonzero)
+
+    # quotient left by div goes to q if given
+    def assign_modulo(self, a, b, c, q=None):
+        # a := b % c is b and b / c is 0 when b < c
+        if self.below(b, c):
+            if is_number(b):
+                self.assign_number(a, b)
+            else:
+                self.assign_variable(a, b)
+            if q:
+                self.assign_number(q, long(0))
+            return
 
-    def assign_modulo(self, a, b, c):
+        nonzero = self.lower(c) > 0
+        r = a
         if is_number(b):
             a, c = self.alloregs(a, c)
+            d = self.quotient(q, r)
             self.cmd('COPY  6   c', c=c)
             b = self.num(b, a)
         elif is_number(c):
             a, b = self.alloregs(a, b)
-            if a != c:
+            if c <= 1:
+                # a := b % 1 and a := b % 0 are 0
+                self.cmd('RESET a', a=a)
+                return
+            if is_power(c):
+                # a := b % 2^k
+                self.mod_pow2(a, b, c.bit_length() - 1)
+                return
+            d = self.quotient(q, r)
+            if a != b:
                 self.cmd('COPY  a   b', a=a, b=b)
             c = self.num(c, 6)
         else:
             a, b, c = self.alloregs(a, b, c)
+            d = self.quotient(q, r)
             self.cmd('COPY  6   c', c=c)
             self.cmd('COPY  a   b', a=a, b=b)
 
-        self.div(a, 6, 7, 8, 9)
-
-    def gen_if(self, cmd):
-        _, cond, block_jump = cmd
-        cond, a, b = cond
-        condition = {
-            '=': self.if_eq,
-            '!=': self.if_neq,
-            '<=': self.if_leq,
-            '>=': self.if_geq,
-            '<': self.if_lt,
-            '>': self.if_gt
-        }
-        condition[cond](a, b, block_jump)
-
-
-    def if_eq(self, a, b, block_jump):
-        if is_number(a) and is_number(b) and a != b:
-            return
-
-        if a == b:
-            # a = b always true
-            self.cmd('JUMP  blockjump', blockjump=block_jump)
-            return
-
-        if is_number(a):
-            a, b = b, a
-
-        if is_number(b):
-            _, a = self.alloregs(a, a)
-            if b == 0:
-                self.cmd('JZERO a   blockjump', a=a, blockjump=block_jump)
-                return
-            b = self.num(b, 9)
-            self.cmd('COPY  8   a', a=a)
-        else:
-            _, a, b = self.alloregs(a, a, b)
-            self.cmd('COPY  8   a', a=a)
-            self.cmd('COPY  9   b', b=b)
-
-        self.cmd('''
-                    SUB     8    b
-                    JZERO   8   $CHECK
-                    JUMP    $END
-            $CHECK  SUB     9   a
-                    JZERO   9   blockjump
-        ''', a=a, b=b, blockjump=block_jump)
-
-    def if_neq(self, a, b, block_jump):
-        if is_number(a) and is_number(b) and a == b:
-            return
-
-        if a == b:
-            # a != a always false
-            return
-
-        if is_number(a):
-            a, b = b, a
-
-        if is_number(b):
-            _, a = self.alloregs(a, a)
-            if b == 0:
-                self.cmd('''
-                    JZERO a   $END
-                    JUMP  blockjump
-                ''', a=a, blockjump=block_jump)
-                return
-            b = self.num(b, 9)
-            self.cmd('COPY  8   a', a=a)
+        self.arith('mod', a, nonzero=nonzero)
+        if q:
+            self.cmd('COPY  d   8', d=d)
+
+    # register of q kept apart from register of r
+    def quotient(self, q, r):
+        if q:
+            d, _ = self.alloregs(q, r)
+            return d
+
+    # mul: 8 * 9, div: 6 / 7, mod: a % 6 into a, divisor known to be
+    # nonzero is not checked unless the routine is shared
+    def arith(self, kind, a, swap=False, nonzero=False):
+        if kind in self.routines:
+            self.call((kind, a))
         else:
-            _, a, b = self.alloregs(a, a, b)
-            self.cmd('COPY  8   a', a=a)
-            self.cmd('COPY  9   b', b=b)
-
-        self.cmd('''
-                    SUB     8    b
-                    JZERO   8   $CHECK
-                    JUMP    blockjump
-            $CHECK  SUB     9   a
-                    JZERO   9   $END
-                    JUMP    blockjump
-        ''', a=a, b=b, blockjump=block_jump)
-
-    def if_leq(self, a, b, block_jump):
-        if is_number(a) and is_number(b):
-            if a <= b:
-                self.cmd('JUMP  blockjump', blockjump=block_jump)
-            return
-
-        if a == b:
-            # a <= a always true
-            self.cmd('JUMP  blockjump', blockjump=block_jump)
-            return
-
-        if is_number(a):
-            _, b = self.alloregs(b, b)
-            a = self.num(a, 8)
-        elif is_number(b):
-            _, a = self.alloregs(a, a)
-            if b == 0:
-                self.cmd('JZERO a   blockjump', a=a, blockjump=block_jump)
-                return
-            self.cmd('COPY  8   a', a=a)
-            b = self.num(b, 9)
-        else:
-            _, a, b = self.alloregs(a, a, b)
-            self.cmd('COPY  8   a', a=a)
-
-        self.cmd('''
-                    SUB     8   b
-                    JZERO   8   blockjump
-        ''', b=b, blockjump=block_jump)
-
-    def if_geq(self, a, b, block_jump):
-        if is_number(a) and is_number(b):
-            if a >= b:
-                self.cmd('JUMP  blockjump', blockjump=block_jump)
-            return
-
-        if a == b:
-            # a >= a always true
-            self.cmd('JUMP  blockjump', blockjump=block_jump)
-            return
+            self.routine(kind, a, swap, nonzero)
 
-        if is_number(a):
-            _, b = self.alloregs(b, b)
-            self.cmd('COPY  9   b', b=b)
-            a = self.num(a, 8)
-        elif is_number(b):
-            _, a = self.alloregs(a, a)
-            b = self.num(b, 9)
+    def routine(self, kind, a, swap, nonzero=False):
+        if kind == 'mul':
+            self.mul(8, 9, a, swap)
+        elif kind == 'div':
+            self.div(6, 7, 8, a, 9, nonzero)
         else:
-            _, a, b = self.alloregs(a, a, b)
-            self.cmd('COPY  9   b', b=b)
-
-        self.cmd('''
-                    SUB     9   a
-                    JZERO   9   blockjump
-        ''', a=a, blockjump=block_jump)
+            self.div(a, 6, 7, 8, 9, nonzero)
+
+    # one instance for every target register, after the program
+    def gen_routines(self):
+        for routine in sorted(self.calls):
+            kind, a = routine
+            self.blocks[routine] = len(self.code)
+            self.routine(kind, a, swap=True)
+            self.dispatch(routine)
+
+    # jump to block_jump if condition holds, cheapest lowering for the
+    # expected outcome, condition decided by bounds needs no code
+    def gen_if(self, cmd):
+        _, (cond, a, b), block_jump = cmd
+        if cond in ('>=', '<'):
+            cond, a, b = {'>=': '<=', '<': '>'}[cond], b, a
 
-    def if_lt(self, a, b, block_jump):
-        if is_number(a) and is_number(b):
-            if a < b:
+        holds = self.holds(cond, a, b)
+        if holds is not None:
+            if holds:
                 self.cmd('JUMP  blockjump', blockjump=block_jump)
             return
 
-        if a == b:
-            # a > a always false
-            return
-
+        self.alloregs(None, *[x for x in (a, b) if not is_number(x)])
+        taken = self.likelihood(block_jump)
+
+        def cost(branch):
+            code, _, number = branch
+            setup = 0
+            if number:
+                number, fresh = number
+                setup = self.num_price(number, 9) if fresh or \
+                    self.held_const(number) is None else 0
+            taken_cost, fall_cost = branch_costs(code)
+            return setup + taken * taken_cost + (1 - taken) * fall_cost
+
+        branches = {
+            '=': self.branch_eq,
+            '!=': self.branch_neq,
+            '<=': self.branch_leq,
+            '>': self.branch_gt
+        }
+        code, labels, number = min(branches[cond](a, b), key=cost)
+
+        labels = dict(labels)
+        if number:
+            number, fresh = number
+            held = None if fresh else self.held_const(number)
+            labels['c'] = self.num(number, 9) if held is None else \
+                self.held(held)
+        self.cmd(code, blockjump=block_jump, **labels)
+
+    # condition known from ranges, None if it is not
+    def holds(self, cond, a, b):
+        return self.bounds.decide((cond, a, b), self.bound)
+
+    # ranges are of iterator values, iterators kept as addresses of
+    # elements have none
+    def upper(self, x):
+        if x in self.offsets:
+            return INF
+        return self.bounds.value(x, self.bound)
+
+    def lower(self, x):
+        if x in self.offsets:
+            return long(0)
+        return self.bounds.lower(x, self.bound)
+
+    # b is known to be less than c
+    def below(self, b, c):
+        return self.upper(b) < self.lower(c)
+
+    # scratch register other than 8 holding number, 8 is overwritten
+    def held_const(self, number):
+        for i, value in self.consts.items():
+            if value == number and is_number(value) and i != 8:
+                return i
+
+    # chance of the jump, loops are left once, jumps back repeat them
+    def likelihood(self, block_jump):
+        if self.flow.depth[block_jump] < self.flow.depth[self.current]:
+            return 0.1
+        if block_jump <= self.current:
+            return 0.9
+        return 0.5
+
+    # registers of x and y named a and b, t and u are ones that may be
+    # overwritten, copied into scratch if they keep variables live after
+    # block, others are written back already
+    def operands(self, x, y):
+        regs, copies = {}, []
+        for var, name, temp, scratch, copy in ((x, 'a', 't', 8, 'COPY t a'),
+                                               (y, 'b', 'u', 9, 'COPY u b')):
+            if is_number(var):
+                copies.append([])
+                continue
+            regs[name] = regs[temp] = self.reg_of(var)
+            if var in self.colors and var in self.live:
+                regs[temp] = scratch
+                copies.append([copy])
+            else:
+                copies.append([])
+        return regs, copies[0], copies[1]
+
+    # BRANCHES: (template jumping to blockjump, its registers,
+    # (number in c, overwritten))
+
+    def branch_leq(self, a, b):
+        if is_number(a):  # b > a - 1
+            return self.branch_gt(b, a - 1)
+
+        regs, copy, _ = self.operands(a, b)
+        if not is_number(b):
+            return [branch(copy + ['SUB t b', 'JZERO t blockjump'], regs)]
+        if b == 0:
+            return [branch(['JZERO a blockjump'], regs)]
+
+        branches = [
+            branch(copy + ['SUB t c', 'JZERO t blockjump'], regs, (b, False)),
+            branch(['SUB c a'] + nonzero('c', b + 1), regs, (b + 1, True))
+        ]
+        if stepped(b):
+            dec = ['DEC t'] * b + ['JZERO t blockjump']
+            branches.append(branch(copy + dec, regs))
+        return branches
+
+    def branch_gt(self, a, b):
+        if is_number(a):  # b <= a - 1
+            return self.branch_leq(b, a - 1)
+
+        up = self.upper(a)
+        regs, copy, copy_b = self.operands(a, b)
+        if not is_number(b):
+            sub = ['SUB t b'] + nonzero('t', up)
+            inc = ['INC u', 'SUB u a', 'JZERO u blockjump']
+            return [branch(copy + sub, regs), branch(copy_b + inc, regs)]
+        if b == 0:
+            return [branch(nonzero('a', up), regs)]
+
+        branches = [
+            branch(copy + ['SUB t c'] + nonzero('t', up - b), regs,
+                   (b, False)),
+            branch(['SUB c a', 'JZERO c blockjump'], regs, (b + 1, True))
+        ]
+        if stepped(b):
+            dec = ['DEC t'] * b + nonzero('t', up - b)
+            branches.append(branch(copy + dec, regs))
+        return branches
+
+    # a - b and b - a both zero
+    def branch_eq(self, a, b):
         if is_number(a):
-            _, b = self.alloregs(b, b)
-            self.cmd('COPY  9   b', b=b)
-            a = self.num(a, 8)
-        elif is_number(b):
-            _, a = self.alloregs(a, a)
-            b = self.num(b, 9)
-        else:
-            _, a, b = self.alloregs(a, a, b)
-            self.cmd('COPY  9   b', b=b)
-
-        self.cmd('''
-                    SUB     9   a
-                    JZERO   9   $END
-                    JUMP    blockjump
-        ''', a=a, blockjump=block_jump)
-
-    def if_gt(self, a, b, block_jump):
-        if is_number(a) and is_number(b):
-            if a > b:
-                self.cmd('JUMP  blockjump', blockjump=block_jump)
-            return
-
-        if a == b:
-            # a > a always false
-            return
+            a, b = b, a
 
+        up = self.upper(a)
+        if not is_number(b):
+            return [self.equality(x, y, ['JZERO 8 $CHECK', 'JUMP $END'],
+                                  ['JZERO u blockjump'])
+                    for x, y in ((a, b), (b, a))]
+        regs, copy, _ = self.operands(a, b)
+        if b == 0:
+            return [branch(['JZERO a blockjump'], regs)]
+        if up <= b:  # a >= b
+            if b == 1:
+                return [branch(['JODD a blockjump'], regs)]
+            return [branch(['SUB c a', 'JZERO c blockjump'], regs, (b, True))]
+
+        sub = ['COPY 8 a', 'SUB 8 c', 'JZERO 8 $CHECK', 'JUMP $END',
+               '$CHECK COPY 8 c', 'SUB 8 a', 'JZERO 8 blockjump']
+        branches = [branch(sub, regs, (b, False))]
+        if stepped(b):
+            dec = ['DEC t'] * (b - 1) + \
+                ['JZERO t $END', 'DEC t', 'JZERO t blockjump']
+            branches.append(branch(copy + dec, regs))
+        return branches
+
+    def branch_neq(self, a, b):
         if is_number(a):
-            _, b = self.alloregs(b, b)
-            a = self.num(a, 8)
-        elif is_number(b):
-            _, a = self.alloregs(a, a)
-            self.cmd('COPY  8   a', a=a)
-            b = self.num(b, 9)
-        else:
-            _, a, b = self.alloregs(a, a, b)
-            self.cmd('COPY  8   a', a=a)
+            a, b = b, a
 
-        self.cmd('''
-                    SUB     8   b
-                    JZERO   8   $END
-                    JUMP    blockjump
-        ''', b=b, blockjump=block_jump)
+        up = self.upper(a)
+        if not is_number(b):
+            return [self.equality(x, y, ['JZERO 8 $CHECK', 'JUMP blockjump'],
+                                  ['JZERO u $END', 'JUMP blockjump'])
+                    for x, y in ((a, b), (b, a))]
+        regs, copy, _ = self.operands(a, b)
+        if b == 0:
+            return [branch(nonzero('a', up), regs)]
+        if up <= b:  # b - a is not zero
+            if b == 1:
+                return [branch(['JZERO a blockjump'], regs)]
+            return [branch(['SUB c a'] + nonzero('c', b), regs, (b, True))]
+
+        sub = ['COPY 8 a', 'SUB 8 c', 'JZERO 8 $CHECK',
+               'JUMP blockjump', '$CHECK COPY 8 c', 'SUB 8 a',
+               'JZERO 8 $END', 'JUMP blockjump']
+        branches = [branch(sub, regs, (b, False))]
+        if stepped(b):
+            dec = ['DEC t'] * (b - 1) + \
+                ['JZERO t blockjump', 'DEC t', 'JZERO t $END',
+                 'JUMP blockjump']
+            branches.append(branch(copy + dec, regs))
+        return branches
+
+    # x - y in 8 decides unless zero, then y - x in u
+    def equality(self, x, y, first, then):
+        regs, _, copy = self.operands(x, y)
+        check = copy + ['SUB u a'] + then
+        check[0] = '$CHECK ' + check[0]
+        return branch(['COPY 8 a', 'SUB 8 b'] + first + check, regs)
 
     def gen_get(self, cmd):
         _, a = cmd
+        self.store_iterators(a)
         a = self.alloregs(a)
         self.cmd('READ  a', a=a)
 
     def gen_put(self, cmd):
         _, a = cmd
         if is_number(a):
-            a = self.num(a, 9)
+            a = self.const(a, 9)
         else:
-            _, a = self.alloregs(a, a)
+            _, a = self.alloregs(None, a)
 
         self.cmd('WRITE a', a=a)
 
+    # quotient and remainder of one division
+    def gen_divmod(self, cmd):
+        _, q, r, b, c = cmd
+        self.store_iterators(q)
+        self.store_iterators(r)
+        self.assign_modulo(r, b, c, q)
+        self.release_iterators(q)
+        self.release_iterators(r)
+
     def gen_goto(self, cmd):
         _, block_jump = cmd
         self.cmd('JUMP  blockjump', blockjump=block_jump)
 
     def gen_halt(self, cmd):
         self.cmd('HALT')
+
+
+# lines of branch code made into template, parsed once for each shape
+def branch(code, regs, number=None):
+    return template('\n'.join(code)), regs, number
+
+
+# x is not zero, JODD when it can only be 0 or 1
+def nonzero(x, bound):
+    if bound <= 1:
+        return ['JODD %s blockjump' % x]
+    return ['JZERO %s $END' % x, 'JUMP blockjump']
+
+
+# DEC number times cheaper than building number and SUB
+def stepped(number):
+    return number < num_cost(number) + 6
+
+
+# cycles of template when it jumps to blockjump and when it falls
+# through, averaged over its paths
+def branch_costs(code):
+    taken, fall = [], []
+
+    def walk(k, cost):
+        while k < len(code.lines):
+            op, operands = code.lines[k]
+            cost += COSTS[OPCODES[op]]
+            if op in JUMPS:
+                kind, target = operands[-1]
+                if kind is LOCAL:
+                    walk(target, cost)
+                else:
+                    taken.append(cost)
+                if op == JUMP:
+                    return
+            k += 1
+        fall.append(cost)
+
+    walk(0, 0)
+    return tuple(float(sum(c)) / len(c) if c else 0 for c in (taken, fall))
+
+
+# routines used at least twice, a call costs less code than the routine
+def outlined(graph):
+    uses = {}
+    for block in graph:
+        for cmd in block:
+            kind = None
+            if cmd[0] == 'assign' and is_operation(cmd[2]):
+                kind = routine_kind(*cmd[2])
+            if cmd[0] == 'divmod':
+                kind = 'mod'
+            uses[kind] = uses.get(kind, 0) + 1
+    return set(kind for kind, n in uses.iteritems() if kind and n > 1)
+
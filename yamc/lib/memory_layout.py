@@ -0,0 +1,61 @@
+# Author Adam Bobowski
+#
+# Memory layout, the most accessed variables get the cheapest addresses
+
+from machine import is_int
+from machine import is_inttab
+from machine import num_cost
+from data_flow import reads
+
+
+class MemoryLayout(object):
+    def __init__(self, colors):
+        self.colors = colors  # variables kept in registers
+
+    # symtab: address, sizes: table size, frequency: block executions
+    def arrange(self, graph, symtab, sizes, frequency):
+        weights = self.weights(graph, frequency)
+        def hottest(v): return (-weights.get(v, 0), symtab[v])
+
+        scalars = [v for v in symtab if v not in sizes]
+        memory = sorted((v for v in scalars if v not in self.colors),
+                        key=hottest)
+        registers = sorted((v for v in scalars if v in self.colors),
+                           key=hottest)
+
+        layout = {}
+        cheapest = sorted(xrange(len(memory)), key=lambda k: (num_cost(k), k))
+        for var, k in zip(memory, cheapest):
+            layout[var] = k
+
+        # accessed tables start at cheap addresses
+        k = len(memory)
+        for table in sorted(sizes, key=hottest):
+            if weights.get(table, 0):
+                k = min(xrange(k, 2 * k + 1), key=lambda b: (num_cost(b), b))
+            layout[table] = k
+            k += sizes[table]
+
+        for var in registers:
+            layout[var] = k
+            k += 1
+
+        return layout
+
+    # memory accesses weighted by block frequency
+    def weights(self, graph, frequency):
+        weights = {}
+        for i, block in enumerate(graph):
+            for cmd in block:
+                values = reads(cmd)
+                if cmd[0] in ('assign', 'get'):
+                    values.append(cmd[1])
+                if cmd[0] == 'divmod':
+                    values.extend(cmd[1:3])
+                for value in values:
+                    if is_inttab(value):
+                        value = value[0]
+                    elif not is_int(value):
+                        continue
+                    weights[value] = weights.get(value, 0) + frequency[i]
+        return weights
@@ -0,0 +1,618 @@
+# Author Adam Bobowski
+#
+# SSA based optimisations of Control Flow Graph
+#
+# SSA form is used for analysis only, every pass rewrites the original
+# blocks: uses are replaced only by variables still holding the same
+# version, so no variables are renamed and no phi copies are needed
+
+from machine import is_number
+from machine import is_int
+from machine import is_inttab
+from machine import is_operation
+from machine import routine_kind
+from data_flow import DataFlow
+from data_flow import defs
+from data_flow import reads
+from data_flow import uses
+from ssa import SSA
+from layout import Layout
+
+PASSES = ('sccp', 'licm', 'gvn', 'copy', 'dce', 'layout')
+
+VARYING = 'varying'  # SCCP lattice bottom, missing value is top
+ZEROED = (long(0), {})  # table elements before any store
+
+
+class Optimizer(object):
+    def __init__(self, passes=PASSES):
+        self.passes = passes
+        self.temps = []  # variables introduced by passes
+
+    # temporaries are added to symtab after the program variables
+    def optimize(self, graph, symtab):
+        for name in PASSES:
+            if name in self.passes:
+                graph = getattr(self, name)(graph)
+
+        k = max(symtab.values()) + 1 if symtab else 0
+        for temp in self.temps:
+            symtab[temp] = k
+            k += 1
+        return graph
+
+    def temp(self):
+        self.temps.append('$h%d' % len(self.temps))
+        return self.temps[-1]
+
+    # constants of scalars and of table elements with number indexes
+    # propagated in turns until neither finds more
+    def sccp(self, graph):
+        changed = True
+        while changed:
+            graph = self.constants(graph)
+            graph, changed = elements(graph)
+        return graph
+
+    # Sparse Conditional Constant Propagation
+    def constants(self, graph):
+        ssa = SSA(graph)
+        values = dict((v, VARYING) for v in ssa.entry.itervalues())
+        edges = set()
+        executable = set([0])
+
+        def lower(version, value):
+            old = values.get(version)
+            if value is None or old == value or old is VARYING:
+                return False
+            values[version] = value if old is None else VARYING
+            return True
+
+        changed = True
+        while changed:
+            changed = False
+            for i in ssa.order:
+                if i not in executable:
+                    continue
+                for version, args in ssa.phis[i].itervalues():
+                    for p, arg in args.iteritems():
+                        if (p, i) in edges:
+                            changed |= lower(version, values.get(arg))
+
+                succ = ssa.flow.succ[i]
+                for k, cmd in enumerate(graph[i]):
+                    env = ssa.envs[i][k]
+                    if cmd[0] == 'assign' and is_int(cmd[1]):
+                        changed |= lower(ssa.defined(i, k),
+                                         evaluate(cmd[2], env, values))
+                    elif cmd[0] == 'get' and is_int(cmd[1]):
+                        changed |= lower(ssa.defined(i, k), VARYING)
+                    elif cmd[0] == 'if':
+                        taken = evaluate(cmd[1], env, values)
+                        if taken is None:
+                            succ = []
+                        elif taken is not VARYING:
+                            succ = [cmd[2] if taken else i + 1]
+
+                for s in succ:
+                    if (i, s) not in edges:
+                        edges.add((i, s))
+                        executable.add(s)
+                        changed = True
+
+        def constant(i, k):
+            def replace(var):
+                value = values.get(ssa.version(i, k, var))
+                return var if value in (None, VARYING) else value
+            return replace
+
+        optimized = []
+        for i, block in enumerate(graph):
+            optimized.append([])
+            if i not in executable:
+                continue
+            for k, cmd in enumerate(block):
+                cmd = substitute(cmd, constant(i, k))
+                if cmd[0] == 'assign':
+                    cmd = ('assign', cmd[1], fold(cmd[2]))
+                if cmd[0] == 'if' and is_number(cmd[1][1]) and \
+                        is_number(cmd[1][2]):
+                    if compare(*cmd[1]):
+                        optimized[-1].append(('goto', cmd[2]))
+                    continue
+                optimized[-1].append(cmd)
+        return optimized
+
+    # Global Value Numbering over dominator tree, recomputation is
+    # replaced by copy of variable still holding the value, copies into
+    # variable holding the value already are removed, both are told on
+    # unpruned SSA as the variable may be dead where it is asked about
+    def gvn(self, graph):
+        ssa = SSA(graph, pruned=False)
+        numbers = {}  # version: value number
+        table = {}    # expression: (variable, version)
+        optimized = [list(block) for block in graph]
+
+        def number(value, env):
+            if is_int(value):
+                return numbers.get(env[value], ('v', env[value]))
+            return value
+
+        stack = [(0, None)]
+        while stack:
+            i, undo = stack.pop()
+            if undo is not None:
+                for key, old in reversed(undo):
+                    if old is None:
+                        del table[key]
+                    else:
+                        table[key] = old
+                continue
+
+            undo = []
+            stack.append((i, undo))
+            for c in reversed(ssa.children[i]):
+                stack.append((c, None))
+
+            for k, cmd in enumerate(graph[i]):
+                if cmd[0] != 'assign' or not is_int(cmd[1]):
+                    continue
+                env = ssa.envs[i][k]
+                a, b = cmd[1], cmd[2]
+                version = ssa.defined(i, k)
+
+                if is_int(b) or is_number(b):
+                    numbers[version] = number(b, env)
+                    if number(a, env) == numbers[version]:
+                        optimized[i][k] = None  # holds the value already
+                    continue
+                if not is_operation(b) or is_inttab(b[1]) or is_inttab(b[2]):
+                    continue
+
+                op, x, y = b
+                key = (op, number(x, env), number(y, env))
+                if op in ('+', '*'):
+                    key = (op,) + tuple(sorted(key[1:]))
+
+                if key in table and env.get(table[key][0]) == table[key][1]:
+                    u, other = table[key]
+                    optimized[i][k] = ('assign', a, u)
+                    numbers[version] = numbers.get(other, ('v', other))
+                    continue
+                undo.append((key, table.get(key)))
+                table[key] = (a, version)
+        return [[cmd for cmd in block if cmd] for block in optimized]
+
+    # Loop-Invariant Code Motion, innermost loops first so hoisted code
+    # may leave outer loops as well, costly invariant expressions are
+    # computed once into temporaries in the preheader, operands are never
+    # reassociated so saturating subtraction keeps its meaning
+    def licm(self, graph):
+        graph = preheaders(graph)
+        ssa = SSA(graph)
+        loops = ssa.loops()
+        for header in sorted(loops, key=lambda h: (len(loops[h]), h)):
+            preheader = ssa.preheader(header, loops[header])
+            if preheader is not None:
+                body = loops[header]
+                latches = [p for p in ssa.predecessors(header) if p in body]
+                # blocks run on every iteration
+                every = [i for i in body
+                         if all(ssa.dominates(i, p) for p in latches)]
+                self.hoist(graph, body, every, preheader,
+                           ssa.flow.live_in[header])
+        return graph
+
+    # every: blocks hoisted from, live: variables live entering the loop
+    def hoist(self, graph, body, every, preheader, live):
+        counts = {}      # variable: definitions in loop
+        written = set()  # tables written in loop
+        for i in body:
+            for cmd in graph[i]:
+                for var in defs(cmd):
+                    counts[var] = counts.get(var, 0) + 1
+                if cmd[0] in ('assign', 'get') and is_inttab(cmd[1]):
+                    written.add(cmd[1][0])
+
+        temps = {}   # hoisted expression: temporary
+        copies = {}  # variable: invariant it holds on every use in loop
+
+        # value with variables replaced by invariant ones, None if varying,
+        # local: invariants copied earlier in block
+        def invariant(value, local):
+            if is_number(value):
+                return value
+            if is_int(value):
+                if value in local:
+                    return local[value]
+                return copies.get(value) if value in counts else value
+            if is_inttab(value):
+                index = invariant(value[1], local)
+                if value[0] in written or index is None:
+                    return None
+                return value[0], index
+            op, b, c = value
+            b, c = invariant(b, local), invariant(c, local)
+            if b is None or c is None:
+                return None
+            return op, b, c
+
+        end = len(graph[preheader])
+        if graph[preheader] and graph[preheader][-1][0] == 'goto':
+            end -= 1
+
+        changed = True
+        while changed:
+            changed = False
+            for i in sorted(every):
+                local = {}
+                for k, cmd in enumerate(graph[i]):
+                    if cmd[0] != 'assign':
+                        for var in defs(cmd):
+                            local.pop(var, None)
+                        continue
+                    _, a, b = cmd
+                    local.pop(a, None)
+                    if not costly(b) and not is_int(b):
+                        continue
+                    b = invariant(b, local)
+                    if b is None:
+                        continue
+
+                    if is_int(b):
+                        value = b
+                    elif b in temps:
+                        value = temps[b]
+                    else:
+                        value = temps[b] = self.temp()
+                        graph[preheader].insert(end, ('assign', value, b))
+                        end += 1
+                        changed = True
+                    graph[i][k] = ('assign', a, value)
+
+                    if not is_int(a):
+                        continue
+                    local[a] = value
+                    # single definition reaching every use in loop
+                    if a not in copies and counts[a] == 1 and a not in live:
+                        copies[a] = value
+                        changed = True
+
+    # uses of copies read the source while it keeps the copied version,
+    # source may be dead there so phis are placed for every variable
+    def copy(self, graph):
+        ssa = SSA(graph, pruned=False)
+        copies = {}  # version: (variable, version) copied
+        for i in ssa.order:
+            for k, cmd in enumerate(graph[i]):
+                if cmd[0] == 'assign' and is_int(cmd[1]) and is_int(cmd[2]):
+                    copies[ssa.defined(i, k)] = (cmd[2],
+                                                 ssa.version(i, k, cmd[2]))
+
+        def source(i, k):
+            env = ssa.envs[i][k]
+
+            def replace(var):
+                version = env[var]
+                while version in copies:
+                    w, copied = copies[version]
+                    if env.get(w) != copied:
+                        break
+                    var, version = w, copied
+                return var
+            return replace
+
+        optimized = [list(block) for block in graph]
+        for i in ssa.order:
+            for k, cmd in enumerate(graph[i]):
+                optimized[i][k] = substitute(cmd, source(i, k))
+        return optimized
+
+    # assignments to scalars never read are removed, so are stores to
+    # table elements with number indexes no command reads
+    def dce(self, graph):
+        ssa = SSA(graph)
+        live = set()
+        work = []
+
+        def mark(i, k, cmd):
+            for var in uses(cmd):
+                version = ssa.version(i, k, var)
+                if version not in live:
+                    live.add(version)
+                    work.append(version)
+
+        for i in ssa.order:
+            for k, cmd in enumerate(graph[i]):
+                if cmd[0] != 'assign' or not is_int(cmd[1]):
+                    mark(i, k, cmd)
+
+        while work:
+            var, site = ssa.versions[work.pop()]
+            if site is None:
+                continue
+            i, k = site
+            if k is not None:
+                mark(i, k, graph[i][k])
+                continue
+            for version in ssa.phis[i][var][1].itervalues():
+                if version not in live:
+                    live.add(version)
+                    work.append(version)
+
+        read = set()  # elements and tables read by variable index
+        for block in graph:
+            for cmd in block:
+                for value in reads(cmd):
+                    if is_inttab(value):
+                        read.add(value if is_number(value[1]) else value[0])
+
+        def needed(i, k, cmd):
+            if cmd[0] != 'assign':
+                return True
+            a = cmd[1]
+            if is_int(a):
+                return ssa.defined(i, k) in live
+            return not is_number(a[1]) or a in read or a[0] in read
+
+        optimized = [list(block) for block in graph]
+        for i in ssa.order:
+            optimized[i] = [cmd for k, cmd in enumerate(graph[i])
+                            if needed(i, k, cmd)]
+        return optimized
+
+
+    # empty blocks removed, jumps threaded, loops tested at the bottom,
+    # tests copied below constant loop bounds are decided and laid out
+    # again
+    def layout(self, graph):
+        graph = Layout().arrange(graph)
+        return Layout().arrange([decide(block) for block in graph])
+
+
+# operations of multiplication or division routines
+def costly(value):
+    return is_operation(value) and bool(routine_kind(*value))
+
+
+# every loop gets a block entering it from outside, a loop entered
+# by falling through from its own block is left without one
+def preheaders(graph):
+    while True:
+        ssa = SSA(graph)
+        for header, body in sorted(ssa.loops().iteritems()):
+            if ssa.preheader(header, body) is None and header - 1 not in body:
+                graph = insert_block(graph, header, body)
+                break
+        else:
+            return [list(block) for block in graph]
+
+
+# new block before header, entries from outside the loop go through it
+def insert_block(graph, header, body):
+    def retarget(i, cmd):
+        if cmd[0] not in ('if', 'goto'):
+            return cmd
+        target = cmd[-1]
+        if target > header or (target == header and i in body):
+            target += 1
+        return cmd[:-1] + (target,)
+
+    inserted = []
+    for i, block in enumerate(graph):
+        if i == header:
+            inserted.append([])
+        inserted.append([retarget(i, cmd) for cmd in block])
+    return inserted
+
+
+# branch on scalars assigned numbers earlier in block decided
+def decide(block):
+    if not block or block[-1][0] != 'if':
+        return block
+    known = {}
+    for cmd in block[:-1]:
+        for var in defs(cmd):
+            known.pop(var, None)
+        if cmd[0] == 'assign' and is_int(cmd[1]) and is_number(cmd[2]):
+            known[cmd[1]] = cmd[2]
+
+    _, condition, target = substitute(block[-1], lambda v: known.get(v, v))
+    if not (is_number(condition[1]) and is_number(condition[2])):
+        return block
+    if compare(*condition):
+        return block[:-1] + [('goto', target)]
+    return block[:-1]
+
+
+# table elements with number indexes holding known numbers are read as
+# them, memory is (value of other elements, {index: value}) for each
+# table, zeroed when program starts
+def elements(graph):
+    succ = DataFlow(graph).succ
+    entry = {0: {}}
+    work = [0]
+    while work:
+        i = work.pop()
+        memory = entry[i]
+        for cmd in graph[i]:
+            memory = store(known(cmd, memory), memory)
+        for s in succ[i]:
+            joined = memory if s not in entry else meet(entry[s], memory)
+            if entry.get(s) != joined:
+                entry[s] = joined
+                work.append(s)
+
+    changed = False
+    optimized = []
+    for i, block in enumerate(graph):
+        optimized.append(list(block))
+        if i not in entry:
+            continue
+        memory = entry[i]
+        for k, cmd in enumerate(block):
+            cmd = known(cmd, memory)
+            changed |= cmd != block[k]
+            optimized[-1][k] = cmd
+            memory = store(cmd, memory)
+    return optimized, changed
+
+
+# command with elements holding numbers replaced by them
+def known(cmd, memory):
+    def value(v):
+        if is_inttab(v) and is_number(v[1]):
+            default, cells = memory.get(v[0], ZEROED)
+            number = cells.get(v[1], default)
+            return v if number is VARYING else number
+        if is_operation(v):
+            return v[0], value(v[1]), value(v[2])
+        return v
+
+    if cmd[0] == 'assign':
+        b = fold(value(cmd[2]))
+        return cmd if b == cmd[2] else ('assign', cmd[1], b)
+    if cmd[0] in ('put', 'if'):
+        return (cmd[0], value(cmd[1])) + cmd[2:]
+    return cmd
+
+
+def store(cmd, memory):
+    if cmd[0] not in ('assign', 'get') or not is_inttab(cmd[1]):
+        return memory
+    table, index = cmd[1]
+    number = cmd[2] if cmd[0] == 'assign' and is_number(cmd[2]) else VARYING
+    default, cells = memory.get(table, ZEROED)
+    memory = dict(memory)
+    if not is_number(index):  # any element may change
+        memory[table] = VARYING, {}
+        return memory
+
+    cells = dict(cells)
+    cells[index] = number
+    if number == default:
+        del cells[index]
+    memory[table] = default, cells
+    return memory
+
+
+def meet(a, b):
+    memory = {}
+    for table in set(a) | set(b):
+        (default_a, cells_a), (default_b, cells_b) = \
+            a.get(table, ZEROED), b.get(table, ZEROED)
+        default = default_a if default_a == default_b else VARYING
+        cells = {}
+        for index in set(cells_a) | set(cells_b):
+            x = cells_a.get(index, default_a)
+            y = cells_b.get(index, default_b)
+            value = x if x == y else VARYING
+            if value != default:
+                cells[index] = value
+        memory[table] = default, cells
+    return memory
+
+
+# comma separated pass names given in command line
+def passes(names):
+    names = tuple(name for name in names.split(',') if name)
+    if any(name not in PASSES for name in names):
+        raise ValueError(names)
+    return names
+
+
+# value of expression or condition, None if not known yet
+def evaluate(value, env, values):
+    if is_number(value):
+        return value
+    if is_int(value):
+        return values.get(env[value])
+    if is_inttab(value):
+        return VARYING
+
+    op, b, c = value
+    b, c = evaluate(b, env, values), evaluate(c, env, values)
+    if zero(op, b, c):
+        return long(0)
+    if VARYING in (b, c):
+        return VARYING
+    if b is None or c is None:
+        return None
+    if op in ('+', '-', '*', '/', '%'):
+        return calculate(op, b, c)
+    return compare(op, b, c)
+
+
+def calculate(op, b, c):
+    if op == '+':
+        return b + c
+    if op == '-':
+        return max(b - c, long(0))
+    if op == '*':
+        return b * c
+    if c == 0:
+        return long(0)
+    if op == '/':
+        return b / c
+    return b % c
+
+
+def compare(op, a, b):
+    return {
+        '=': a == b,
+        '!=': a != b,
+        '<': a < b,
+        '>': a > b,
+        '<=': a <= b,
+        '>=': a >= b
+    }[op]
+
+
+def fold(value):
+    if not is_operation(value):
+        return value
+    op, b, c = value
+    if is_number(b) and is_number(c):
+        return calculate(op, b, c)
+    if zero(op, b, c):
+        return long(0)
+    # b + 0, b - 0, b * 1, b / 1 and 0 + c, 1 * c
+    if (op in ('+', '-') and c == 0) or (op in ('*', '/') and c == 1):
+        return b
+    if (op == '+' and b == 0) or (op == '*' and b == 1):
+        return c
+    return value
+
+
+# operation giving 0 whatever its other operand is
+def zero(op, b, c):
+    if op == '*':
+        return b == 0 or c == 0
+    if op in ('/', '%'):
+        return b == 0 or c == 0 or (op == '%' and c == 1)
+    return op == '-' and b == 0
+
+
+# command with scalars read replaced by replace(variable)
+def substitute(cmd, replace):
+    def value(v):
+        if is_int(v):
+            return replace(v)
+        if is_inttab(v):
+            return v[0], value(v[1])
+        if is_operation(v):
+            return v[0], value(v[1]), value(v[2])
+        return v
+
+    def target(v):
+        return value(v) if is_inttab(v) else v
+
+    if cmd[0] == 'assign':
+        return 'assign', target(cmd[1]), value(cmd[2])
+    if cmd[0] == 'get':
+        return 'get', target(cmd[1])
+    if cmd[0] == 'put':
+        return 'put', value(cmd[1])
+    if cmd[0] == 'if':
+        return 'if', value(cmd[1]), cmd[2]
+    return cmd
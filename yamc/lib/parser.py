@@ -2,12 +2,16 @@
 #
 # Parser
 
+import hashlib
 import logging
+import os
 
 import ply.yacc as yacc
 
 from lexer import Lexer
 from errors import YamcError
+from cache import cache_dir
+from cache import publish
 
 
 class Parser(object):
@@ -130,14 +134,38 @@ class Parser(object):
         logging.error('Unknown input "%s"', p.value)
         raise YamcError()
 
-    # parser
+    # parser, LALR tables are built once for every grammar and kept in
+    # the user cache directory
     def __init__(self):
         self.lexer = Lexer()
         self.tokens = self.lexer.tokens
-        self.parser = yacc.yacc(module=self, write_tables=0, debug=False)
+        self.parser = self.build()
+
+    def build(self):
+        directory = cache_dir()
+        if directory is None:
+            return yacc.yacc(module=self, write_tables=0, debug=False)
+
+        path = os.path.join(directory, 'parsetab-%s.pickle' % self.grammar())
+        if os.path.exists(path):
+            return yacc.yacc(module=self, debug=False, picklefile=path)
+
+        built = []
+        publish(path, lambda temp: built.append(
+            yacc.yacc(module=self, debug=False, picklefile=temp)))
+        return built[0]
+
+    # hash of rules, tokens and table format, tables of other grammars
+    # or PLY versions are never read
+    def grammar(self):
+        rules = sorted((name, getattr(self, name).__doc__)
+                       for name in dir(self) if name.startswith('p_'))
+        key = repr((yacc.__tabversion__, self.tokens, rules))
+        return hashlib.sha1(key).hexdigest()[:16]
 
     def parse(self, data):
         if data:
+            self.lexer.lexer.lineno = 1  # parser may parse many programs
             return self.parser.parse(data, self.lexer.lexer, 0, 0, None)
         else:
             logging.error("Input file is empty")
@@ -0,0 +1,301 @@
+# Author Adam Bobowski
+#
+# Peephole optimisation of machine code
+
+from itertools import product
+
+from instruction import Instruction
+from instruction import JUMPS
+from instruction import OPCODE
+from vm import COSTS
+from vm import OPCODES
+from vm import (RESET, INC, DEC, SHL, SHR, ADD, SUB, COPY, JUMP, HALT)
+
+ENDS = (JUMP, HALT)  # next instruction entered only by jump
+KEEPS = set(OPCODE[op] for op in ('JUMP', 'JZERO', 'JODD', 'STORE', 'WRITE',
+                                  'HALT'))  # registers keep their values
+
+
+class Rule(object):
+    # pattern and replacement are instructions separated by ';', operands
+    # are names bound to registers, @names to jump targets, alternative
+    # opcodes are separated by '|', where checks the bound names
+    def __init__(self, pattern, replacement, where=None):
+        self.pattern = [parse_pattern(p) for p in split(pattern)]
+        self.replacement = [parse_pattern(p) for p in split(replacement)]
+        self.where = where
+
+        # replacement is cheaper than every instance of the pattern
+        saved = sum(min(cycles(op) for op in ops) for ops, _ in self.pattern)
+        cost = sum(cycles(op) for (op,), _ in self.replacement)
+        if cost >= saved or len(self.replacement) > len(self.pattern):
+            raise ValueError('rule %s does not pay off' % pattern)
+
+    # bindings of names if instructions match the pattern
+    def match(self, instructions):
+        if len(instructions) < len(self.pattern):
+            return None
+        env = {}
+        for (ops, names), ins in zip(self.pattern, instructions):
+            operands = ins.operands()
+            if ins.op not in ops or len(names) != len(operands):
+                return None
+            for name, value in zip(names, operands):
+                if env.setdefault(name, value) != value:
+                    return None
+        return env
+
+    def rewrite(self, env):
+        return [Instruction(op, *[env[name] for name in names])
+                for (op,), names in self.replacement]
+
+
+class Peephole(object):
+    def __init__(self, rules=None):
+        self.rules = RULES if rules is None else rules
+        self.width = max(len(rule.pattern) for rule in self.rules)
+        self.opcodes = {}  # opcodes: rules with pattern of these opcodes
+        for rule in self.rules:
+            for ops in product(*[ops for ops, _ in rule.pattern]):
+                self.opcodes.setdefault(ops, []).append(rule)
+        self.first = set(ops[0] for ops in self.opcodes)
+        self.code = []     # instructions, None once removed
+        self.targets = set()
+
+    # code: instructions with resolved jumps, blocks: block: line_no,
+    # rewritten until nothing changes, jumps and blocks follow removed
+    # lines
+    def optimize(self, code, blocks):
+        self.code = list(code)
+        lines = dict(blocks)
+
+        changed = True
+        while changed:
+            changed = self.thread()
+            self.targets = set(ins.target() for ins in self.code
+                               if ins.op in JUMPS)
+            changed |= self.unreachable()
+            changed |= self.constants()
+            changed |= self.apply_rules()
+            remap = self.compact()
+            lines = dict((b, remap[l]) for b, l in lines.iteritems())
+
+        return self.code, lines
+
+    # jumps to unconditional jumps go straight to their targets
+    def thread(self):
+        changed = False
+        for ins in self.code:
+            if ins.op in JUMPS:
+                seen = set()
+                t = ins.target()
+                while t < len(self.code) and self.code[t].op == JUMP and \
+                        t not in seen:
+                    seen.add(t)
+                    t = self.code[t].a
+                if t != ins.target():
+                    ins.retarget(t)
+                    changed = True
+        return changed
+
+    # lines after JUMP or HALT up to the next jump target
+    def unreachable(self):
+        changed = False
+        dead = False
+        for k, ins in enumerate(self.code):
+            if k in self.targets:
+                dead = False
+            if dead:
+                self.code[k] = None
+                changed = True
+            elif ins.op in ENDS:
+                dead = True
+        return changed
+
+    # number built in register by RESET, INC and SHL which it or another
+    # register holds already is not built again, values are known from
+    # the last jump target on
+    def constants(self):
+        changed = False
+        values = {}
+        k = 0
+        while k < len(self.code):
+            if k in self.targets:
+                values = {}
+            ins = self.code[k]
+            if ins is None:
+                k += 1
+                continue
+            end = self.chain(k)
+            if end > k:
+                a, number = ins.a, self.chain_value(k, end)
+                held = [r for r, v in sorted(values.iteritems())
+                        if v == number]
+                if values.get(a) == number:
+                    for i in xrange(k, end):
+                        self.code[i] = None
+                    changed = True
+                elif held and end - k > 1:
+                    self.code[k] = Instruction(COPY, a, held[0])
+                    for i in xrange(k + 1, end):
+                        self.code[i] = None
+                    changed = True
+                values[a] = number
+                k = end
+                continue
+            values = transfer(ins, values)
+            k += 1
+        return changed
+
+    # end of RESET a, INC a, SHL a sequence starting at k, no jump
+    # target inside, k if there is none
+    def chain(self, k):
+        ins = self.code[k]
+        if ins.op != RESET:
+            return k
+        end = k + 1
+        while end < len(self.code) and end not in self.targets and \
+                self.code[end] is not None and \
+                self.code[end].op in (INC, SHL) and \
+                self.code[end].a == ins.a:
+            end += 1
+        return end
+
+    def chain_value(self, k, end):
+        number = 0
+        for ins in self.code[k + 1:end]:
+            number = number + 1 if ins.op == INC else number * 2
+        return number
+
+    def apply_rules(self):
+        changed = False
+        for k in xrange(len(self.code)):
+            if self.code[k] is None or self.code[k].op not in self.first:
+                continue
+            positions = self.window(k)
+            window = [self.code[i] for i in positions]
+            ops = tuple(ins.op for ins in window)
+            rules = [rule for n in xrange(1, len(ops) + 1)
+                     for rule in self.opcodes.get(ops[:n], ())]
+            for rule in rules:
+                env = rule.match(window)
+                if env is None:
+                    continue
+                n = len(rule.pattern)
+                for name in env:
+                    if name[0] == '@':
+                        env[name] = self.live(env[name])
+                env['next'] = self.live(positions[n - 1] + 1)
+                if rule.where and not rule.where(env):
+                    continue
+                replacement = rule.rewrite(env)
+                for i, p in enumerate(positions[:n]):
+                    self.code[p] = replacement[i] \
+                        if i < len(replacement) else None
+                changed = True
+                break
+        return changed
+
+    # lines of instructions from k on, none of them but the first
+    # jumped to
+    def window(self, k):
+        window = []
+        for i in xrange(k, len(self.code)):
+            if i != k and i in self.targets:
+                break
+            if self.code[i] is not None:
+                window.append(i)
+                if len(window) == self.width:
+                    break
+        return window
+
+    # line executed when jumping to k
+    def live(self, k):
+        while k < len(self.code) and self.code[k] is None:
+            k += 1
+        return k
+
+    # removed lines dropped, jumps to them go to the next kept line
+    def compact(self):
+        remap = []
+        kept = []
+        for ins in self.code:
+            remap.append(len(kept))
+            if ins is not None:
+                kept.append(ins)
+        remap.append(len(kept))
+        for ins in kept:
+            if ins.op in JUMPS:
+                ins.retarget(remap[ins.target()])
+        self.code = kept
+        return remap
+
+
+def split(text):
+    return [p.strip() for p in text.split(';') if p.strip()]
+
+
+def parse_pattern(text):
+    ins = text.split()
+    return tuple(OPCODE[op] for op in ins[0].split('|')), ins[1:]
+
+
+def cycles(op):
+    return COSTS[OPCODES[op]]
+
+
+# known register values after instruction
+def transfer(ins, values):
+    op = ins.op
+    if op in KEEPS:
+        return values
+    a = ins.a
+    known = values.get(a)
+    other = values.get(ins.b)
+    values = dict(values)
+    values.pop(a, None)
+
+    value = None
+    if op == RESET:
+        value = 0
+    elif op == COPY:
+        value = other
+    elif known is None:
+        pass
+    elif op == INC:
+        value = known + 1
+    elif op == DEC:
+        value = max(known - 1, 0)
+    elif op == SHL:
+        value = known * 2
+    elif op == SHR:
+        value = known / 2
+    elif other is None:
+        pass
+    elif op == ADD:
+        value = known + other
+    elif op == SUB:
+        value = max(known - other, 0)
+    if value is not None:
+        values[a] = value
+    return values
+
+
+RULES = [
+    Rule('COPY a a', ''),
+    Rule('COPY a b ; COPY b a', 'COPY a b'),
+    Rule('STORE r x ; LOAD r x', 'STORE r x'),
+    Rule('LOAD r x ; STORE r x', 'LOAD r x', lambda m: m['r'] != m['x']),
+    Rule('RESET a ; DEC a', 'RESET a'),
+    Rule('INC a ; DEC a', ''),
+    Rule('SHL a ; SHR a', ''),
+    Rule('ADD a b ; SUB a b', '', lambda m: m['a'] != m['b']),
+    # value overwritten before it is read
+    Rule('RESET|INC|DEC|SHL|SHR a ; RESET a', 'RESET a'),
+    Rule('COPY|ADD|SUB|LOAD a b ; RESET a', 'RESET a'),
+    Rule('RESET|INC|DEC|SHL|SHR a ; COPY a b', 'COPY a b',
+         lambda m: m['a'] != m['b']),
+    # jumps to the next line
+    Rule('JUMP @t', '', lambda m: m['@t'] == m['next']),
+    Rule('JZERO|JODD a @t', '', lambda m: m['@t'] == m['next']),
+]
@@ -0,0 +1,59 @@
+# Author Adam Bobowski
+#
+# Global register allocation
+
+from data_flow import defs
+from data_flow import uses
+from data_flow import indexes
+
+
+class RegisterAllocation(object):
+    def __init__(self, registers):
+        self.registers = registers  # registers for global variables
+
+    # variables live across blocks: register
+    # priority based graph colouring, the heaviest variables go first
+    def allocate(self, graph, flow):
+        candidates = set()
+        for live in flow.live_in + flow.live_out:
+            candidates |= live
+
+        weights = self.weights(graph, flow)
+        interference = self.interference(graph, flow)
+
+        colors = {}
+        for var in sorted(candidates, key=lambda v: (-weights.get(v, 0), v)):
+            taken = set(colors[n] for n in interference.get(var, ())
+                        if n in colors)
+            free = [r for r in self.registers if r not in taken]
+            if free:
+                colors[var] = free[0]
+        return colors
+
+    # accesses weighted by loop nesting
+    def weights(self, graph, flow):
+        weights = {}
+        for i, block in enumerate(graph):
+            for cmd in block:
+                for var in uses(cmd) | defs(cmd):
+                    weights[var] = weights.get(var, 0) + 10 ** flow.depth[i]
+        return weights
+
+    # table elements cached in registers are written back at the end
+    # of block so their indexes have to stay intact until then
+    def interference(self, graph, flow):
+        edges = {}
+
+        def add(a, b):
+            edges.setdefault(a, set()).add(b)
+            edges.setdefault(b, set()).add(a)
+
+        for i, block in enumerate(graph):
+            live = flow.live_out[i] | indexes(block)
+            for cmd in reversed(block):
+                d = defs(cmd)
+                for a in d:
+                    for b in (live | uses(cmd) | d) - set([a]):
+                        add(a, b)
+                live = (live - d) | uses(cmd)
+        return edges
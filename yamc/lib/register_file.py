@@ -0,0 +1,74 @@
+# Author Adam Bobowski
+#
+# Register file
+
+
+class RegisterFile(object):
+    def __init__(self, registers):
+        self.registers = list(registers)  # registers to allocate from
+        self.clear()
+
+    def clear(self):
+        self.vars = [None for _ in xrange(10)]     # register: variable
+        self.dirty = [False for _ in xrange(10)]   # modified since load
+        self.stamp = [0 for _ in xrange(10)]       # last access
+        self.clock = 0
+        self.where = {}    # variable: register
+        self.tables = {}   # table: registers with its elements
+        self.offsets = {}  # index variable: registers with table elements
+
+    def __getitem__(self, reg):
+        return self.vars[reg]
+
+    def __contains__(self, var):
+        return var in self.where
+
+    def reg(self, var):
+        return self.where.get(var)
+
+    def free(self):
+        for i in self.registers:
+            if self.vars[i] is None:
+                return i
+
+    def assign(self, reg, var, dirty=False):
+        self.release(reg)
+        self.vars[reg] = var
+        self.dirty[reg] = dirty
+        self.where[var] = reg
+        if isinstance(var, tuple):  # table element
+            self.tables.setdefault(var[0], set()).add(reg)
+            self.offsets.setdefault(var[1], set()).add(reg)
+        self.touch(reg)
+
+    def release(self, reg):
+        var = self.vars[reg]
+        if var is None:
+            return
+        del self.where[var]
+        if isinstance(var, tuple):
+            self.tables[var[0]].discard(reg)
+            self.offsets[var[1]].discard(reg)
+        self.vars[reg] = None
+        self.dirty[reg] = False
+
+    def touch(self, reg):
+        self.clock += 1
+        self.stamp[reg] = self.clock
+
+    # registers with elements of table
+    def elements(self, table):
+        return sorted(self.tables.get(table, ()))
+
+    # registers with table elements indexed by variable
+    def indexed_by(self, var):
+        return sorted(self.offsets.get(var, ()))
+
+    def occupied(self):
+        return [i for i in self.registers if self.vars[i] is not None]
+
+    # highest rank wins, least recently used on ties
+    def victim(self, exclude, rank):
+        candidates = [i for i in self.registers
+                      if self.vars[i] not in exclude]
+        return max(candidates, key=lambda i: (rank(i), -self.stamp[i]))
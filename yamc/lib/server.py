@@ -0,0 +1,96 @@
+# Author Adam Bobowski
+#
+# Compile server, one process answering compile requests
+#
+# Request is a line of JSON {"file": path, "out": path}, out defaults to
+# file with .mr extension, answer is a line of JSON {"file": path,
+# "out": path, "errors": [messages]}, out is written if errors is empty
+
+import argparse
+import json
+import os
+import SocketServer
+import sys
+
+from compiler import Compiler
+from optimizer import PASSES
+from optimizer import passes
+
+
+def main(argv):
+    args = parse_args(argv)
+    compiler = Compiler(args.outline_arith, args.passes, not args.no_cache)
+    if args.socket:
+        serve_socket(compiler, args.socket)
+    else:
+        serve(compiler, sys.stdin, sys.stdout)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='yamc.py serve',
+        description='Answer compile requests read from stdin or a socket.')
+    parser.add_argument(
+        '--socket',
+        help='listen on Unix socket SOCKET instead of stdin')
+    parser.add_argument(
+        '--outline-arith',
+        action='store_true',
+        help='emit multiplication and division once as subroutines')
+    parser.add_argument(
+        '--passes',
+        type=passes,
+        default=PASSES,
+        help='comma separated SSA optimisations out of %s' % ','.join(PASSES))
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='compile even if the same source was compiled before')
+    return parser.parse_args(argv)
+
+
+# requests answered in order until end of input or empty line
+def serve(compiler, rfile, wfile):
+    for line in iter(rfile.readline, ''):
+        if not line.strip():
+            break
+        wfile.write(json.dumps(answer(compiler, line)) + '\n')
+        wfile.flush()
+
+
+# failure of one request is its answer, server keeps answering others
+def answer(compiler, line):
+    try:
+        request = json.loads(line)
+        file_path = request['file']
+        out_path = request.get('out')
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return {'errors': ['Bad request %r' % line.strip()]}
+    if not isinstance(file_path, basestring) or \
+            not isinstance(out_path, (basestring, type(None))):
+        return {'errors': ['Bad request %r' % line.strip()]}
+
+    out_path = out_path or os.path.splitext(file_path)[0] + '.mr'
+    try:
+        errors = compiler.compile_file(file_path, out_path)
+    except Exception as e:
+        errors = ['Internal error %s: %s' % (type(e).__name__, e)]
+    return {'file': file_path, 'out': out_path, 'errors': errors}
+
+
+# connections served one at a time by the same compiler
+def serve_socket(compiler, path):
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            serve(compiler, self.rfile, self.wfile)
+
+    if os.path.exists(path):
+        os.remove(path)
+    server = SocketServer.UnixStreamServer(path, Handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
@@ -0,0 +1,198 @@
+# Author Adam Bobowski
+#
+# Static Single Assignment form of Control Flow Graph scalars
+
+from data_flow import DataFlow
+from data_flow import defs
+from data_flow import uses
+
+
+# versions of pruned form are right only where variable is live,
+# unpruned tells also whether a dead variable still holds a version
+class SSA(object):
+    def __init__(self, graph, pruned=True):
+        self.graph = graph
+        self.flow = DataFlow(graph)
+        self.pruned = pruned
+
+        self.reachable = self.reach()
+        self.order = self.reverse_postorder()
+        self.idom = self.dominators()
+        self.children = {i: [] for i in self.order}
+        for i in self.order[1:]:
+            self.children[self.idom[i]].append(i)
+        self.frontier = self.frontiers()
+
+        self.versions = {}  # version: (variable, (block, position) of def)
+        self.phis = [{} for _ in graph]  # variable: (version, {pred: arg})
+        self.envs = [[] for _ in graph]  # versions before every command
+        self.exits = {}     # block: versions after its last command
+        self.place_phis()
+        self.rename()
+
+    def reach(self):
+        seen = set([0])
+        stack = [0]
+        while stack:
+            for s in self.flow.succ[stack.pop()]:
+                if s not in seen:
+                    seen.add(s)
+                    stack.append(s)
+        return seen
+
+    def reverse_postorder(self):
+        order = []
+        seen = set([0])
+        stack = [(0, iter(self.flow.succ[0]))]
+        while stack:
+            i, succ = stack[-1]
+            for s in succ:
+                if s not in seen:
+                    seen.add(s)
+                    stack.append((s, iter(self.flow.succ[s])))
+                    break
+            else:
+                order.append(i)
+                stack.pop()
+        order.reverse()
+        return order
+
+    # Cooper, Harvey, Kennedy iterative algorithm
+    def dominators(self):
+        index = {b: k for k, b in enumerate(self.order)}
+        idom = {0: 0}
+
+        def intersect(a, b):
+            while a != b:
+                while index[a] > index[b]:
+                    a = idom[a]
+                while index[b] > index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for i in self.order[1:]:
+                preds = [p for p in self.flow.pred[i] if p in idom]
+                new = preds[0]
+                for p in preds[1:]:
+                    new = intersect(p, new)
+                if idom.get(i) != new:
+                    idom[i] = new
+                    changed = True
+        return idom
+
+    def frontiers(self):
+        frontier = {i: set() for i in self.order}
+        for i in self.order:
+            preds = self.predecessors(i)
+            if len(preds) < 2:
+                continue
+            for p in preds:
+                runner = p
+                while runner != self.idom[i]:
+                    frontier[runner].add(i)
+                    runner = self.idom[runner]
+        return frontier
+
+    def predecessors(self, i):
+        return [p for p in self.flow.pred[i] if p in self.reachable]
+
+    def dominates(self, a, b):
+        while b != a and b != 0:
+            b = self.idom[b]
+        return a == b
+
+    # natural loops, header: blocks of loops closed by its back edges
+    def loops(self):
+        loops = {}
+        for i in self.order:
+            for h in self.flow.succ[i]:
+                if not self.dominates(h, i):
+                    continue
+                body = loops.setdefault(h, set([h]))
+                stack = [i]
+                while stack:
+                    b = stack.pop()
+                    if b not in body:
+                        body.add(b)
+                        stack.extend(self.predecessors(b))
+        return loops
+
+    # only block entering loop from outside and leading only to it
+    def preheader(self, header, body):
+        outside = [p for p in self.predecessors(header) if p not in body]
+        if len(outside) == 1 and self.flow.succ[outside[0]] == [header]:
+            return outside[0]
+        return None
+
+    # pruned, only where variable is live, if asked so
+    def place_phis(self):
+        blocks = {}
+        for i in self.order:
+            for cmd in self.graph[i]:
+                for var in defs(cmd):
+                    blocks.setdefault(var, set()).add(i)
+
+        for var, defined in blocks.iteritems():
+            work = list(defined)
+            while work:
+                for f in self.frontier[work.pop()]:
+                    live = var in self.flow.live_in[f]
+                    if var not in self.phis[f] and (live or not self.pruned):
+                        self.phis[f][var] = (None, {})
+                        if f not in defined:
+                            defined.add(f)
+                            work.append(f)
+
+    def new_version(self, var, site):
+        version = len(self.versions)
+        self.versions[version] = (var, site)
+        return version
+
+    # every variable enters the program with an unknown version
+    def rename(self):
+        env = {}
+        for i in self.order:
+            for cmd in self.graph[i]:
+                for var in uses(cmd) | defs(cmd):
+                    if var not in env:
+                        env[var] = self.new_version(var, None)
+            for var in self.phis[i]:
+                if var not in env:
+                    env[var] = self.new_version(var, None)
+        self.entry = dict(env)
+
+        stack = [(0, env)]
+        while stack:
+            i, env = stack.pop()
+            env = dict(env)
+            for var in sorted(self.phis[i]):
+                _, args = self.phis[i][var]
+                env[var] = self.new_version(var, (i, None))
+                self.phis[i][var] = (env[var], args)
+
+            for k, cmd in enumerate(self.graph[i]):
+                self.envs[i].append(env)
+                for var in defs(cmd):
+                    env = dict(env)
+                    env[var] = self.new_version(var, (i, k))
+            self.exits[i] = env
+
+            for s in self.flow.succ[i]:
+                for var, (_, args) in self.phis[s].iteritems():
+                    args[i] = env[var]
+            for c in reversed(self.children[i]):
+                stack.append((c, env))
+
+    # version defined by command k of block i
+    def defined(self, i, k):
+        for var in defs(self.graph[i][k]):
+            if k + 1 < len(self.graph[i]):
+                return self.envs[i][k + 1][var]
+            return self.exits[i][var]
+
+    # version of variable read by command k of block i
+    def version(self, i, k, var):
+        return self.envs[i][k][var]
@@ -14,9 +14,12 @@ class CodeAnalysis(object):
         self.glob = None   # global variables
         self.init = None   # initilized variables
         self.iter_no = 0
+        self.sizes = {}    # table sizes
 
     def check(self, ptree):
         _, declarations, commands = ptree
+        self.iter_no = 0  # analyser may check many programs
+        self.sizes = {}
 
         # static analysis
         self.check_double_declaration(declarations)
@@ -161,13 +164,14 @@ class CodeAnalysis(object):
         l = self.ast_value(l, it_rep)
         r = self.ast_value(r, it_rep)
 
+        # folded like the machine computes, division by 0 gives 0
         if isinstance(l, long) and isinstance(r, long):
             ops = {
                 '+': lambda l, r: l + r,
-                '-': lambda l, r: max(l - r, 0),
+                '-': lambda l, r: max(l - r, long(0)),
                 '*': lambda l, r: l * r,
-                '/': lambda l, r: l / r,
-                '%': lambda l, r: l % r
+                '/': lambda l, r: l / r if r else long(0),
+                '%': lambda l, r: l % r if r else long(0)
             }
             return ops[operation](l, r)
         return (expr[1], l, r)
@@ -235,6 +239,7 @@ class CodeAnalysis(object):
         helpers = list(chain.from_iterable((f(x), g(x))
                        for x in xrange(self.iter_no)))
         integers.extend(helpers)
+        self.sizes = dict(tables)
 
         k = 0
         symtab = {}
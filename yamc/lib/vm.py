@@ -0,0 +1,152 @@
+# Author Adam Bobowski
+#
+# Register machine simulator
+
+import logging
+import random
+
+from errors import YamcError
+
+
+OPCODES = (
+    'READ', 'WRITE', 'LOAD', 'STORE', 'COPY', 'ADD', 'SUB',
+    'SHR', 'SHL', 'INC', 'DEC', 'RESET', 'JUMP', 'JZERO', 'JODD', 'HALT'
+)
+
+# same costs as interpreter/interpreter.cc
+COSTS = {
+    'READ': 100, 'WRITE': 100,
+    'LOAD': 20, 'STORE': 20,
+    'ADD': 5, 'SUB': 5,
+    'COPY': 1, 'SHR': 1, 'SHL': 1, 'INC': 1, 'DEC': 1, 'RESET': 1,
+    'JUMP': 1, 'JZERO': 1, 'JODD': 1,
+    'HALT': 0
+}
+
+(READ, WRITE, LOAD, STORE, COPY, ADD, SUB,
+ SHR, SHL, INC, DEC, RESET, JUMP, JZERO, JODD, HALT) = range(len(OPCODES))
+
+
+class VirtualMachine(object):
+    def __init__(self, code, blocks=None):
+        self.program = []  # flat [opcode, arg1, arg2, ...] array
+        self.size = 0      # number of instructions
+        self.blocks = {}   # block: line_no mapping
+        self.counts = []   # line_no: executions
+
+        self.outputs = []
+        self.cycles = 0
+
+        self.load(code)
+        if blocks:
+            self.blocks = {b: int(l) for b, l in blocks.iteritems()}
+
+    def load(self, code):
+        opcodes = {name: i for i, name in enumerate(OPCODES)}
+        self.program = []
+
+        for k, line in enumerate(code):
+            line = line.split()
+            if not line or line[0] not in opcodes:
+                logging.error('In line %d', k)
+                logging.error('Unknown instruction "%s"', ' '.join(line))
+                raise YamcError()
+
+            args = [int(x) for x in line[1:]] + [0, 0]
+            self.program.extend((opcodes[line[0]], args[0], args[1]))
+
+        self.size = len(self.program) / 3
+
+    # outputs <- program(inputs)
+    # registers start with garbage just like in the reference interpreter
+    def run(self, inputs=(), seed=None, limit=None):
+        program = self.program
+        size = self.size
+        inputs = iter(inputs)
+        outputs = []
+        counts = [0] * size
+
+        rand = random.Random(seed)
+        r = [rand.randint(0, 2 ** 31 - 1) for _ in xrange(10)]
+        mem = {}
+
+        lr = 0
+        steps = 0
+        while 0 <= lr < size:
+            steps += 1
+            if limit and steps > limit:
+                logging.error('Step limit %d exceeded', limit)
+                raise YamcError()
+
+            counts[lr] += 1
+            i = 3 * lr
+            op, a, b = program[i], program[i + 1], program[i + 2]
+
+            if op == JZERO:
+                lr = b if r[a] == 0 else lr + 1
+                continue
+            if op == JUMP:
+                lr = a
+                continue
+            if op == JODD:
+                lr = b if r[a] % 2 else lr + 1
+                continue
+            if op == HALT:
+                break
+
+            if op == COPY:
+                r[a] = r[b]
+            elif op == ADD:
+                r[a] += r[b]
+            elif op == SUB:
+                r[a] = r[a] - r[b] if r[a] >= r[b] else 0
+            elif op == SHR:
+                r[a] >>= 1
+            elif op == SHL:
+                r[a] <<= 1
+            elif op == INC:
+                r[a] += 1
+            elif op == DEC:
+                r[a] = r[a] - 1 if r[a] else 0
+            elif op == RESET:
+                r[a] = 0
+            elif op == LOAD:
+                r[a] = mem.get(r[b], 0)
+            elif op == STORE:
+                mem[r[b]] = r[a]
+            elif op == READ:
+                try:
+                    r[a] = long(next(inputs))
+                except StopIteration:
+                    logging.error('In line %d', lr)
+                    logging.error('No more input to READ')
+                    raise YamcError()
+            elif op == WRITE:
+                outputs.append(r[a])
+            lr += 1
+        else:
+            logging.error('Call of nonexistent instruction %d', lr)
+            raise YamcError()
+
+        self.counts = counts
+        self.outputs = outputs
+        self.cycles = sum(COSTS[OPCODES[program[3 * k]]] * n
+                          for k, n in enumerate(counts) if n)
+        return outputs
+
+    # opcode: executions
+    def op_counts(self):
+        ops = {}
+        for k, n in enumerate(self.counts):
+            if n:
+                op = OPCODES[self.program[3 * k]]
+                ops[op] = ops.get(op, 0) + n
+        return ops
+
+    # block: entries
+    def block_counts(self):
+        return {b: self.counts[l] if l < self.size else 0
+                for b, l in self.blocks.iteritems()}
+
+    def executed(self):
+        return sum(self.counts)
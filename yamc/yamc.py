@@ -6,52 +6,114 @@
 # Compiler runner
 
 import argparse
+import os
+import sys
 
-from lib.errors import YamcError
-from lib.parser import Parser
-from lib.static_analysis import CodeAnalysis
-from lib.flow_graph import FlowGraph
-from lib.machine_code import MachineCode
+# modules of compiler phases are imported by functions using them, so
+# runs not compiling do not load them
 
 
 def main():
+    if sys.argv[1:2] == ['bench']:
+        from lib import bench
+        bench.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['serve']:
+        from lib import server
+        server.main(sys.argv[2:])
+        return
+
     args = parse_args()
-    compilation(args.file_path, args.out)
+    if len(args.file_paths) == 1 and args.out_dir is None:
+        compilation(args.file_paths[0], args.out or 'a.mr',
+                    args.outline_arith, args.passes, not args.no_cache)
+    else:
+        batch(args.file_paths, args.out_dir, args.jobs, args.outline_arith,
+              args.passes, not args.no_cache)
 
 
 def parse_args():
+    from lib.optimizer import PASSES
+    from lib.optimizer import passes
+
     parser = argparse.ArgumentParser(description='Compile with Yamc.')
     parser.add_argument(
-        'file_path',
+        'file_paths',
+        nargs='+',
+        metavar='file_path',
         help='.imp file'
         )
     parser.add_argument(
         '--out',
-        default="a.mr",
-        help='place the output into OUT')
-    return parser.parse_args()
+        help='place the output of single file into OUT, a.mr by default')
+    parser.add_argument(
+        '--out-dir',
+        help='place the output of every file into OUT_DIR, by default '
+             'next to the file when many are given')
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        help='compile many files in JOBS processes, one for every CPU by '
+             'default')
+    parser.add_argument(
+        '--outline-arith',
+        action='store_true',
+        help='emit multiplication and division once as subroutines')
+    parser.add_argument(
+        '--passes',
+        type=passes,
+        default=PASSES,
+        help='comma separated SSA optimisations out of %s' % ','.join(PASSES))
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='compile even if the same source was compiled before')
+    args = parser.parse_args()
+    if args.out and (len(args.file_paths) > 1 or args.out_dir):
+        parser.error('--out is for a single file, use --out-dir')
+    return args
 
 
-def compilation(file_path, out_path):
-    parser = Parser()
-    analyser = CodeAnalysis()
-    flow_graph = FlowGraph()
-    machine_code = MachineCode()
+def compilation(file_path, out_path, outline_arith=False, passes=None,
+                use_cache=True):
+    from lib.compiler import Compiler
+    from lib.errors import YamcError
+
+    compiler = Compiler(outline_arith, passes, use_cache)
 
     with open(file_path, 'r') as f:
         content = f.read()
 
     try:
-        ptree = parser.parse(content)
-        symtab, ast = analyser.check(ptree)
-        graph = flow_graph.convert(ast)
-        code = machine_code.gen(graph, symtab)
+        compiler.compile(content, out_path)
     except YamcError:
         exit(1)
 
-    with open(out_path, 'w') as f:
-        for line in code:
-            f.write(line + '\n')
+
+# file.imp compiled into file.mr, errors of every file are reported
+# under its name in order of files
+def batch(file_paths, out_dir, jobs=None, outline_arith=False, passes=None,
+          use_cache=True):
+    from multiprocessing import cpu_count
+    from lib.compiler import compile_files
+
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    files = [(f, output_path(f, out_dir)) for f in file_paths]
+    failed = False
+    for file_path, errors in compile_files(files, jobs or cpu_count(),
+                                           outline_arith, passes, use_cache):
+        for message in errors:
+            sys.stderr.write('%s: %s\n' % (file_path, message))
+        failed |= bool(errors)
+    if failed:
+        exit(1)
+
+
+def output_path(file_path, out_dir):
+    name = os.path.splitext(os.path.basename(file_path))[0] + '.mr'
+    return os.path.join(out_dir or os.path.dirname(file_path), name)
 
 
 if __name__ == '__main__':